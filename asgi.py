@@ -0,0 +1,11 @@
+"""
+ASGI entry point, e.g. `uvicorn asgi:application --workers 4`
+
+Serves the task reads and the event stream with async database access, and hands the other
+requests to the Flask app on ASGI_THREADS threads, see project.async_resources. Needs the
+asgiref and aiosqlite (or asyncpg for PostgreSQL) packages.
+"""
+from manage import app
+from project.async_resources import AsyncResources
+
+application = AsyncResources(app)
@@ -0,0 +1,37 @@
+"""
+Production server settings: gunicorn -c gunicorn.conf.py wsgi:app
+
+The app (create_app, JWTManager and the resources) is loaded once in the master and forked
+into one worker per core. Migrations run once in the master before the workers start.
+Each worker serves WORKER_THREADS requests at a time on threads (gthread), since an open
+/tasks/events stream holds its thread for as long as the client stays connected; the sync
+worker would serve one stream per worker and kill it after the timeout. A worker with all its
+threads busy leaves new connections queued, so size WORKER_THREADS for the expected streams
+plus the other requests. Workers are recycled after MAX_REQUESTS requests (with jitter, so they
+do not all restart at once). Send HUP to replace the workers gracefully; with the app preloaded, code changes
+need a new master: send USR2, then QUIT to the old master once the new one is serving.
+"""
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+# Read by the app's config (loaded after this file), so per process stores can refuse to run
+os.environ['WEB_CONCURRENCY'] = str(workers)
+worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('WORKER_THREADS', 32))
+preload_app = True
+max_requests = int(os.environ.get('MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', max_requests // 10))
+timeout = int(os.environ.get('WORKER_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+accesslog = '-'
+
+
+def on_starting(server):
+    from manage import upgrade_database
+    upgrade_database()
+
+
+def post_fork(server, worker):
+    from manage import dispose_engines
+    dispose_engines(close=False)
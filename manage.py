@@ -1,7 +1,10 @@
+import os
 import unittest
+import click
 from project import create_app, db
 from flask_jwt_extended import JWTManager
 from flask_restful import Api
+from flask_migrate import upgrade
 from project.manage_resources import ResourcesManager
 
 app = create_app()
@@ -9,10 +12,25 @@ jwt = JWTManager(app)
 ResourcesManager.add_resources(app)
 
 from project import schema
+from project.importer import TaskImporter
 
-@app.before_first_request
-def create_tables():
-    db.create_all()
+def upgrade_database():
+    """
+    Applies pending migrations. Run once per deployment, before serving, rather than in each
+    worker, then drops the connections it opened so forked workers do not inherit them.
+    """
+    with app.app_context():
+        upgrade(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
+    dispose_engines()
+
+def dispose_engines(close=True):
+    """
+    Empties the connection pools of the primary and replica engines. A forked worker passes
+    close=False, leaving the parent's connections open while its own pool starts empty.
+    """
+    with app.app_context():
+        for engine in [db.engine] + app.extensions['replica_engines']:
+            engine.dispose(close=close)
 
 @jwt.token_in_blacklist_loader
 def token_blacklisting_check(raw_token):
@@ -22,5 +40,45 @@ def token_blacklisting_check(raw_token):
     token = raw_token['jti']
     return schema.RevokedTokens.is_token_revoked(token)
 
+@app.cli.command('import-tasks')
+@click.argument('username')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', type=click.Choice(TaskImporter.FORMATS), default=None,
+              help='Defaults to csv for .csv files and ndjson otherwise')
+@click.option('--chunk-size', type=int, default=None, help='Tasks inserted per transaction')
+def import_tasks(username, path, format, chunk_size):
+    """
+    Imports tasks for a user from an NDJSON or CSV file
+    """
+    user = schema.User.get_user_by_name(username)
+    if user is None:
+        raise click.BadParameter("User %s doesn't exist" % username, param_hint='username')
+    importer = TaskImporter(
+        user_id=user.id,
+        chunk_size=chunk_size or app.config['TASKS_IMPORT_CHUNK_SIZE'],
+        max_errors=app.config['TASKS_IMPORT_MAX_ERRORS']
+    )
+    with open(path, newline='', encoding='utf-8') as f:
+        result = importer.run(f, format or ('csv' if path.endswith('.csv') else 'ndjson'))
+    for error in result['errors']:
+        click.echo("line %d: %s" % (error['line'], error['message']), err=True)
+    click.echo("Imported %d tasks, %d rows failed" % (result['imported'], result['failed']))
+
+@app.cli.command('rebuild-task-counters')
+def rebuild_task_counters():
+    """
+    Recomputes every user's task counters from the tasks table
+    """
+    schema.User.rebuild_task_counters()
+    click.echo("Task counters rebuilt")
+
+@app.cli.command('purge-task-tombstones')
+def purge_task_tombstones():
+    """
+    Deletes the task tombstones older than TASK_TOMBSTONE_RETENTION seconds
+    """
+    click.echo("Purged %d tombstones" % schema.TaskTombstone.purge_expired())
+
 if __name__=="__main__":
+    upgrade_database()
     app.run(debug=True, host='0.0.0.0')
\ No newline at end of file
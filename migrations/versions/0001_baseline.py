@@ -0,0 +1,57 @@
+"""baseline schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created earlier by db.create_all() already have these tables,
+    # so only the missing ones are created.
+    existing_tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'user' not in existing_tables:
+        op.create_table(
+            'user',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(length=80), nullable=False),
+            sa.Column('email', sa.String(length=120), nullable=False),
+            sa.Column('password', sa.String(length=80), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('email'),
+            sa.UniqueConstraint('username')
+        )
+    if 'tasks' not in existing_tables:
+        op.create_table(
+            'tasks',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('heading', sa.String(length=360), nullable=True),
+            sa.Column('description', sa.Text(), nullable=True),
+            sa.Column('is_completed', sa.Boolean(), nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if 'revoked_tokens' not in existing_tables:
+        op.create_table(
+            'revoked_tokens',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('token', sa.String(length=120), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('revoked_tokens')
+    op.drop_table('tasks')
+    op.drop_table('user')
@@ -0,0 +1,40 @@
+"""revoked tokens keyed by indexed jti with expiry
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 10:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = [column['name'] for column in sa.inspect(op.get_bind()).get_columns('revoked_tokens')]
+    if 'jti' in columns:
+        return
+    # Rows without a token cannot be keyed by jti. Rows revoked before this revision have
+    # no known expiry, so the automatic purge leaves them in place.
+    op.execute("DELETE FROM revoked_tokens WHERE token IS NULL")
+    with op.batch_alter_table('revoked_tokens') as batch_op:
+        batch_op.alter_column('token', new_column_name='jti', existing_type=sa.String(length=120),
+                              nullable=False)
+        batch_op.add_column(sa.Column('expires_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_revoked_tokens_jti', 'revoked_tokens', ['jti'], unique=True)
+    op.create_index('ix_revoked_tokens_expires_at', 'revoked_tokens', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_revoked_tokens_expires_at', table_name='revoked_tokens')
+    op.drop_index('ix_revoked_tokens_jti', table_name='revoked_tokens')
+    with op.batch_alter_table('revoked_tokens') as batch_op:
+        batch_op.drop_column('expires_at')
+        batch_op.alter_column('jti', new_column_name='token', existing_type=sa.String(length=120),
+                              nullable=True)
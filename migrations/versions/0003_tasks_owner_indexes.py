@@ -0,0 +1,31 @@
+"""indexes on tasks for per-user listing and pagination
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 10:10:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY does not lock writers on PostgreSQL but cannot run
+    # inside a transaction; other backends ignore the flag.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_tasks_user_id_id', 'tasks', ['user_id', 'id'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_tasks_user_id_is_completed_id', 'tasks', ['user_id', 'is_completed', 'id'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_tasks_user_id_is_completed_id', table_name='tasks', postgresql_concurrently=True)
+        op.drop_index('ix_tasks_user_id_id', table_name='tasks', postgresql_concurrently=True)
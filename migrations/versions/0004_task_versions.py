@@ -0,0 +1,31 @@
+"""per task and per user task versions for ETags
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 10:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Server defaults let existing rows be filled in without rewriting them row by row.
+    with op.batch_alter_table('tasks') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('tasks_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('tasks_version')
+    with op.batch_alter_table('tasks') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,43 @@
+"""change sequence numbers and tombstones for delta sync
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 10:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tasks') as batch_op:
+        batch_op.add_column(sa.Column('change_seq', sa.Integer(), server_default='0', nullable=False))
+    with op.get_context().autocommit_block():
+        op.create_index('ix_tasks_user_id_change_seq', 'tasks', ['user_id', 'change_seq'], unique=False,
+                        postgresql_concurrently=True)
+    op.create_table(
+        'task_tombstones',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('task_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('change_seq', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_task_tombstones_user_id_change_seq', 'task_tombstones', ['user_id', 'change_seq'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_task_tombstones_user_id_change_seq', table_name='task_tombstones')
+    op.drop_table('task_tombstones')
+    op.drop_index('ix_tasks_user_id_change_seq', table_name='tasks')
+    with op.batch_alter_table('tasks') as batch_op:
+        batch_op.drop_column('change_seq')
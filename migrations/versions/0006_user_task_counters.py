@@ -0,0 +1,35 @@
+"""per user task counters
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 10:25:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('tasks_total', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('tasks_completed', sa.Integer(), server_default='0', nullable=False))
+    # Same as `flask rebuild-task-counters`; rerun it after deploying if tasks were written
+    # by the previous release while this ran.
+    op.execute(
+        'UPDATE "user" SET '
+        'tasks_total = (SELECT count(*) FROM tasks WHERE tasks.user_id = "user".id), '
+        'tasks_completed = (SELECT count(*) FROM tasks WHERE tasks.user_id = "user".id AND tasks.is_completed)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('tasks_completed')
+        batch_op.drop_column('tasks_total')
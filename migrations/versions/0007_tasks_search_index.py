@@ -0,0 +1,32 @@
+"""full text search index over task heading and description
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 10:30:00.000000
+
+"""
+from alembic import op
+from project.search import CREATE_FTS_STATEMENTS, REBUILD_FTS_STATEMENT, DROP_FTS_STATEMENTS
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Only SQLite has an index (FTS5); other backends search with LIKE.
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in CREATE_FTS_STATEMENTS:
+        op.execute(statement)
+    op.execute(REBUILD_FTS_STATEMENT)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in DROP_FTS_STATEMENTS:
+        op.execute(statement)
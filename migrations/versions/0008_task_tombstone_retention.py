@@ -0,0 +1,33 @@
+"""task tombstone retention
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 10:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('task_tombstones') as batch_op:
+        batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), server_default=sa.func.current_timestamp(),
+                                      nullable=False))
+        batch_op.create_index('ix_task_tombstones_deleted_at', ['deleted_at'])
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('tombstones_purged_seq', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('tombstones_purged_seq')
+    with op.batch_alter_table('task_tombstones') as batch_op:
+        batch_op.drop_index('ix_task_tombstones_deleted_at')
+        batch_op.drop_column('deleted_at')
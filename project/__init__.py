@@ -1,8 +1,14 @@
 import os
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
+from project.cache import TTLCache, create_cache, require_shared_cache
+from project.hashing import PasswordHasher
+from project.metrics import init_metrics
+from project.engine import get_engine_options, is_sqlite, set_sqlite_pragmas
+from project.routing import RoutingSQLAlchemy, init_replicas
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+migrate = Migrate(render_as_batch=True)
 
 
 def create_app(test_config=None):
@@ -16,9 +22,57 @@ def create_app(test_config=None):
     app = Flask(__name__)
     if test_config is None:
         app_settings = os.getenv('APP_SETTINGS')
+        if not app_settings:
+            # Refuse to guess: falling back to a development config would let a deployment that
+            # forgot the variable serve production traffic with development settings.
+            raise RuntimeError("APP_SETTINGS must name a config class, e.g. project.config.ProductionConfig")
         app.config.from_object(app_settings)
     else:
         app.config.from_object(test_config)
+    init_metrics(app)
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = get_engine_options(uri, app.config)
     db.init_app(app)
+    if is_sqlite(uri):
+        with app.app_context():
+            set_sqlite_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
+    init_replicas(app)
+    migrate.init_app(app, db)
+    app.extensions['revoked_tokens_cache'] = TTLCache(app.config['REVOKED_TOKENS_CACHE_SIZE'])
+    app.extensions['task_cache'] = create_cache(
+        app.config['TASK_CACHE_BACKEND'],
+        size=app.config['TASK_CACHE_SIZE'],
+        ttl=app.config['TASK_CACHE_TTL'],
+        redis_url=app.config['TASK_CACHE_REDIS_URL'],
+        prefix='task:'
+    )
+    if app.config['IDEMPOTENCY_BACKEND'] is not None:
+        require_shared_cache(app, 'IDEMPOTENCY_BACKEND')
+    app.extensions['idempotency_store'] = create_cache(
+        app.config['IDEMPOTENCY_BACKEND'],
+        size=app.config['IDEMPOTENCY_STORE_SIZE'],
+        ttl=app.config['IDEMPOTENCY_KEY_TTL'],
+        redis_url=app.config['IDEMPOTENCY_REDIS_URL'],
+        prefix='idempotency:'
+    )
+    app.extensions['task_writer'] = None
+    if app.config['TASK_WRITE_COALESCING']:
+        from project.coalescer import WriteCoalescer
+        app.extensions['task_writer'] = WriteCoalescer(
+            app,
+            max_batch=app.config['TASK_WRITE_BATCH_SIZE'],
+            max_delay=app.config['TASK_WRITE_BATCH_DELAY']
+        )
+    from project.events import TaskEventHub
+    app.extensions['task_events'] = TaskEventHub(
+        app,
+        poll_interval=app.config['TASK_EVENTS_POLL_INTERVAL'],
+        queue_size=app.config['TASK_EVENTS_QUEUE_SIZE']
+    )
+    app.extensions['password_hasher'] = PasswordHasher(
+        rounds=app.config['PASSWORD_HASH_ROUNDS'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_MAX_PENDING']
+    )
     return app
 
@@ -0,0 +1,299 @@
+import asyncio
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+from flask_jwt_extended import decode_token
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from werkzeug.http import quote_etag
+from werkzeug.wrappers import Request
+from project.engine import get_async_database_url, get_async_engine_options, is_sqlite, set_sqlite_pragmas
+from project.events import format_event
+from project.parsers import Parser, ValidationError
+from project.schema import User, Task, RevokedTokens
+from project.task_resources import get_task_etag, list_tasks_etag
+
+
+class ThreadPoolWsgiToAsgiInstance(WsgiToAsgiInstance):
+    """
+    asgiref's WSGI adapter running the app on the given thread pool. asgiref's own runs the
+    requests of a process one at a time, on a single thread (thread_sensitive).
+    """
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+
+    async def run_wsgi_app(self, body):
+        run_wsgi_app = WsgiToAsgiInstance.__dict__['run_wsgi_app'].func
+        await sync_to_async(run_wsgi_app, thread_sensitive=False, executor=self.executor)(self, body)
+
+
+def make_request(scope):
+    """
+    Wraps an ASGI http scope in a werkzeug request, to read its query string and headers
+    """
+    adapter = WsgiToAsgiInstance(None)
+    adapter.scope = scope
+    return Request(adapter.build_environ(scope, BytesIO()))
+
+
+class AsyncResources:
+    """
+    ASGI application serving the Flask app's routes on an asyncio event loop.
+
+    The reads that clients poll or keep open are served natively, with async database access
+    through SQLAlchemy's asyncio engine: GET /tasks/<id>, /tasks, /tasks/summary and the
+    /tasks/events stream. They decode the access token and check its revocation like the Flask
+    app, and answer with the same bodies and ETags. Waiting on the database or on the next
+    event holds no thread, so one process keeps thousands of these clients connected.
+
+    Every other request goes to the Flask app on ASGI_THREADS threads, as do these reads when
+    they are not a plain success (missing, invalid or revoked token, legacy token without a
+    user id, invalid params, unknown task). The Flask app then gives the same response, error
+    or not, as under WSGI. Native reads always go to the primary database and skip the task
+    cache, whose redis client would block the event loop.
+    """
+    def __init__(self, app):
+        self.app = app
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        self.engine = create_async_engine(get_async_database_url(uri), **get_async_engine_options(uri, app.config))
+        if is_sqlite(uri):
+            set_sqlite_pragmas(self.engine.sync_engine, app.config['SQLITE_PRAGMAS'])
+        self.executor = ThreadPoolExecutor(app.config['ASGI_THREADS'], thread_name_prefix='asgi')
+        self.routes = [
+            (re.compile(r'/tasks/(?P<id>[0-9]+)'), '/tasks/<int:id>', self.get_task),
+            (re.compile(r'/tasks'), '/tasks', self.list_tasks),
+            (re.compile(r'/tasks/summary'), '/tasks/summary', self.task_summary),
+            (re.compile(r'/tasks/events'), '/tasks/events', self.task_events),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            for pattern, route, handler in self.routes:
+                match = pattern.fullmatch(scope['path'])
+                if match is not None:
+                    if await handler(make_request(scope), self._timed_send(send, route), receive,
+                                     **match.groupdict()) is not False:
+                        return
+                    break
+        await self.fallback(scope, receive, send)
+
+    async def fallback(self, scope, receive, send):
+        """
+        Serves the request with the Flask app, on the thread pool
+        """
+        await ThreadPoolWsgiToAsgiInstance(self.app, self.executor)(scope, receive, send)
+
+    def _timed_send(self, send, route):
+        """
+        Wraps send to record the request's latency, up to the response start, like the Flask app does
+        """
+        start = time.perf_counter()
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                self.app.extensions['metrics'].request_duration.observe(
+                    time.perf_counter() - start, method='GET', route=route, status=message['status'])
+            await send(message)
+        return timed_send
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def close(self):
+        """
+        Closes the database connections and the Flask app's threads
+        """
+        await self.engine.dispose()
+        self.executor.shutdown(wait=False)
+
+    async def authenticate(self, session, request):
+        """
+        Returns the user id of the request's access token, or None unless it has a valid and
+        unrevoked one carrying the id
+        """
+        start = time.perf_counter()
+        authorization = request.headers.get('Authorization', '')
+        if not authorization.startswith('Bearer '):
+            return None
+        # No await inside: the app context is pushed and popped before another request runs
+        with self.app.app_context():
+            try:
+                claims = decode_token(authorization[len('Bearer '):])
+            except Exception:
+                return None
+        user_id = claims.get(self.app.config['JWT_USER_CLAIMS'], {}).get('user_id')
+        if claims.get('type') != 'access' or user_id is None:
+            return None
+        revoked = self.app.extensions['revoked_tokens_cache'].get(claims['jti'])
+        if revoked is None:
+            revoked = (await session.execute(RevokedTokens.select_revoked(claims['jti']))).scalar()
+            with self.app.app_context():
+                RevokedTokens.cache_revoked(claims['jti'], revoked)
+        self.app.extensions['metrics'].jwt_verify_duration.observe(time.perf_counter() - start, token_type='access')
+        return None if revoked else user_id
+
+    def page_limit(self, limit):
+        return min(limit or self.app.config['TASKS_PAGE_SIZE_DEFAULT'], self.app.config['TASKS_PAGE_SIZE_MAX'])
+
+    async def respond(self, send, request, data, etag=None):
+        """
+        Sends data as JSON, or 304 if the request's If-None-Match matches etag
+        """
+        headers = []
+        if etag is not None:
+            headers.append((b'etag', quote_etag(etag).encode()))
+            if request.if_none_match.contains(etag):
+                await send({'type': 'http.response.start', 'status': 304, 'headers': headers})
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+        body = (json.dumps(data, **self.app.config.get('RESTFUL_JSON', {})) + '\n').encode()
+        headers += [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def get_task(self, request, send, receive, id):
+        """
+        GET /tasks/<id>, see task_resources.GetTask
+        """
+        async with AsyncSession(self.engine) as session:
+            user_id = await self.authenticate(session, request)
+            if user_id is None:
+                return False
+            try:
+                fields = Parser.get_task.validate(request.args)['fields']
+            except ValidationError:
+                return False
+            columns = None if fields is None else tuple(set(fields) | {'id', 'version'})
+            task = (await session.execute(Task.select_task(int(id), user_id, columns))).scalars().first()
+            if task is None:
+                return False
+            task = task.to_dict(columns or Task.FIELDS)
+        await self.respond(send, request, {field: task[field] for field in fields or Task.FIELDS},
+                           get_task_etag(task, fields))
+
+    async def list_tasks(self, request, send, receive):
+        """
+        GET /tasks, see task_resources.ListTasks
+        """
+        async with AsyncSession(self.engine) as session:
+            user_id = await self.authenticate(session, request)
+            if user_id is None:
+                return False
+            try:
+                list_data = Parser.list_tasks.validate(request.args)
+            except ValidationError:
+                return False
+            tasks_version = (await session.execute(User.select_tasks_version(user_id))).scalar()
+            etag = list_tasks_etag(user_id, tasks_version, request.query_string)
+            if request.if_none_match.contains(etag):
+                await self.respond(send, request, None, etag)
+                return
+            limit = self.page_limit(list_data['limit'])
+            statement = Task.select_tasks_page(
+                user_id, limit,
+                cursor=list_data['cursor'],
+                is_completed=list_data['is_completed'],
+                min_id=list_data['min_id'],
+                max_id=list_data['max_id'],
+                fields=list_data['fields']
+            )
+            tasks, next_cursor = Task.split_page((await session.execute(statement)).scalars().all(), limit)
+            fields = list_data['fields'] or Task.FIELDS
+            data = {
+                'tasks': [task.to_dict(fields) for task in tasks],
+                'next_cursor': next_cursor
+            }
+        await self.respond(send, request, data, etag)
+
+    async def task_summary(self, request, send, receive):
+        """
+        GET /tasks/summary, see task_resources.TaskSummary
+        """
+        async with AsyncSession(self.engine) as session:
+            user_id = await self.authenticate(session, request)
+            if user_id is None:
+                return False
+            counters = (await session.execute(User.select_task_counters(user_id))).first()
+        await self.respond(send, request, {
+            'total': counters.tasks_total,
+            'completed': counters.tasks_completed,
+            'pending': counters.tasks_total - counters.tasks_completed
+        })
+
+    async def task_events(self, request, send, receive):
+        """
+        GET /tasks/events, see task_resources.TaskEvents. The stream waits for changes on the
+        event loop, and is closed as soon as the client disconnects.
+        """
+        hub = self.app.extensions['task_events']
+        heartbeat = self.app.config['TASK_EVENTS_HEARTBEAT']
+        try:
+            last_event_id = int(request.headers.get('Last-Event-ID', ''))
+        except ValueError:
+            last_event_id = None
+        async with AsyncSession(self.engine) as session:
+            user_id = await self.authenticate(session, request)
+            if user_id is None:
+                return False
+            tasks_version = (await session.execute(User.select_tasks_version(user_id))).scalar()
+            subscription = hub.subscribe(user_id, cursor=tasks_version, loop=asyncio.get_running_loop())
+            try:
+                # the deletions after a cursor older than the retained tombstones are lost; resync
+                expired = last_event_id is not None and last_event_id < (
+                    await session.execute(User.select_tombstones_purged_seq(user_id))).scalar()
+                missed = []
+                if last_event_id is not None and not expired and last_event_id < subscription.cursor:
+                    tasks, tombstones = Task.select_changes(user_id, last_event_id, subscription.cursor)
+                    missed = Task.to_change_log((await session.execute(tasks)).scalars().all(),
+                                                (await session.execute(tombstones)).all())
+            except:
+                hub.unsubscribe(subscription)
+                raise
+        disconnected = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no')
+            ]})
+            for event in missed:
+                await self.send_event(send, format_event(event))
+            while not expired and not subscription.overflowed:
+                waiting = asyncio.ensure_future(subscription.wait_async(heartbeat))
+                await asyncio.wait([waiting, disconnected], return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    waiting.cancel()
+                    return
+                events = waiting.result()
+                for event in events:
+                    await self.send_event(send, format_event(event))
+                if not events and not subscription.overflowed:
+                    await self.send_event(send, ': keepalive\n\n')
+            await self.send_event(send, 'event: reset\ndata: {}\n\n')
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            hub.unsubscribe(subscription)
+
+    @staticmethod
+    async def send_event(send, text):
+        await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': True})
+
+    @staticmethod
+    async def wait_for_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
@@ -0,0 +1,269 @@
+import itertools
+import json
+import math
+import socket
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urlsplit
+from urllib.request import Request, urlopen
+from project import db
+from project.schema import User, Task
+
+OPERATIONS = ('login', 'create', 'list', 'get', 'update', 'delete', 'refresh')
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest rank percentile of an ascending list
+    """
+    return sorted_values[max(int(math.ceil(p / 100.0 * len(sorted_values))) - 1, 0)]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3)
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a message per operation whose p95 latency grew, or throughput dropped, by more
+    than tolerance (a fraction) relative to the baseline
+    """
+    regressions = []
+    for operation, result in sorted(results.items()):
+        base = baseline.get(operation)
+        if base is None:
+            continue
+        if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append('%s: p95 %.3f ms, baseline %.3f ms' % (operation, result['p95_ms'], base['p95_ms']))
+        if result['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append('%s: throughput %.2f req/s, baseline %.2f req/s' % (
+                operation, result['throughput'], base['throughput']))
+    return regressions
+
+
+class HttpResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+
+    def get_json(self):
+        return json.loads(self.data.decode())
+
+
+class HttpClient:
+    """
+    Sends the benchmark's requests to a running server instead of the in-process test client,
+    to compare serving modes (e.g. WSGI and ASGI) on the same database. Implements the subset
+    of the Flask test client interface the benchmark uses.
+    """
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def get(self, path, headers=None, query_string=None):
+        if query_string:
+            path += '?' + urlencode(query_string)
+        return self._request('GET', path, headers)
+
+    def post(self, path, headers=None, data=None):
+        return self._request('POST', path, headers, urlencode(data or {}).encode())
+
+    def open_stream(self, path, headers):
+        """
+        Opens a streamed GET request and leaves its response unread, as an idle client would
+        :return: the connected socket, closing it ends the request
+        """
+        url = urlsplit(self.url)
+        connection = socket.create_connection((url.hostname, url.port or 80))
+        lines = ['GET %s HTTP/1.1' % path, 'Host: %s' % url.netloc]
+        lines.extend('%s: %s' % header for header in headers.items())
+        connection.sendall(('\r\n'.join(lines) + '\r\n\r\n').encode())
+        return connection
+
+    def _request(self, method, path, headers, body=None):
+        request = Request(self.url + path, data=body, headers=headers or {}, method=method)
+        if body is not None:
+            request.add_header('Content-Type', 'application/x-www-form-urlencoded')
+        try:
+            with urlopen(request) as response:
+                return HttpResponse(response.status, response.read())
+        except HTTPError as e:
+            return HttpResponse(e.code, e.read())
+
+
+class Benchmark:
+    """
+    Seeds the app's database with users and tasks, then drives the app through its endpoints
+    with the Flask test client, so requests go through routing, parsing, JWT checks and the
+    database exactly as served, minus the network. With an HttpClient the requests go to a
+    running server on the same database instead. Each operation is run for requests
+    iterations, round robin over the seeded users.
+    """
+    PASSWORD = 'benchmark462'
+
+    def __init__(self, app, users, tasks_per_user, requests, client=None):
+        self.app = app
+        self.users = users
+        self.tasks_per_user = tasks_per_user
+        self.requests = requests
+        self.client = client or app.test_client()
+        self.sessions = []
+
+    def seed(self):
+        """
+        Creates the users, sharing one password hash, and their tasks with bulk inserts
+        """
+        with self.app.app_context():
+            password = User.generate_hash(self.PASSWORD)
+            db.session.bulk_insert_mappings(User, [
+                {'username': 'bench%d' % i, 'email': 'bench%d@example.com' % i, 'password': password}
+                for i in range(self.users)
+            ])
+            db.session.commit()
+            user_ids = [user.id for user in User.query.order_by(User.id)]
+            for user_id in user_ids:
+                Task.bulk_create(user_id, [
+                    {'heading': 'Task %d' % i, 'description': 'Seeded task %d description' % i, 'is_completed': False}
+                    for i in range(self.tasks_per_user)
+                ])
+
+    def _start_session(self, username):
+        """
+        Logs the user in and collects the ids of their tasks
+        """
+        response = self.client.post('/user/login', data={'username': username, 'password': self.PASSWORD})
+        if response.status_code != 200:
+            raise RuntimeError('Login failed for seeded user %s' % username)
+        session = dict(response.get_json(), username=username, created_ids=[])
+        tasks = self.client.get('/tasks', query_string={'fields': 'id', 'limit': self.tasks_per_user or 1},
+                                headers=self._headers(session)).get_json()['tasks']
+        session['task_ids'] = [task['id'] for task in tasks]
+        return session
+
+    def _headers(self, session, token='access_token'):
+        return {'Authorization': 'Bearer ' + session[token]}
+
+    def run(self):
+        """
+        :return: dict of operation to its summary
+        """
+        self.sessions = [self._start_session('bench%d' % i) for i in range(self.users)]
+        return {operation: self._measure(getattr(self, '_' + operation)) for operation in OPERATIONS}
+
+    def _measure(self, request):
+        latencies = []
+        errors = 0
+        sessions = itertools.cycle(self.sessions)
+        validation = self._validation_histogram()
+        validation_start = validation.total()[1] if validation else 0
+        start = time.perf_counter()
+        for i in range(self.requests):
+            session = next(sessions)
+            request_start = time.perf_counter()
+            response = request(session, i)
+            latencies.append(time.perf_counter() - request_start)
+            if response is None or response.status_code != 200:
+                errors += 1
+        summary = summarize(latencies, errors, time.perf_counter() - start)
+        if validation:
+            summary['validation_us'] = round((validation.total()[1] - validation_start) / self.requests * 1e6, 3)
+        return summary
+
+    def _validation_histogram(self):
+        """
+        The app's request validation histogram, when requests are served in process
+        """
+        metrics = self.app.extensions.get('metrics')
+        if isinstance(self.client, HttpClient) or metrics is None:
+            return None
+        return metrics.request_validation_duration
+
+    def run_concurrent(self, clients, streams=0):
+        """
+        Measures task reads (the "get" operation) sent by clients concurrent clients, requests
+        reads each, while streams /tasks/events streams are held open by idle clients. A server
+        that holds a thread per open stream or per waiting request serves the reads slower, or
+        not at all, once they outnumber its threads.
+        :return: summary of the reads, with the number of clients and streams
+        """
+        if streams and not isinstance(self.client, HttpClient):
+            raise ValueError("Streams can only be held open on a running server")
+        self.sessions = [self._start_session('bench%d' % i) for i in range(self.users)]
+        sessions = itertools.cycle(self.sessions)
+        connections = [self.client.open_stream('/tasks/events', self._headers(next(sessions)))
+                       for _ in range(streams)]
+        latencies = []
+        errors = []
+
+        def read(session):
+            for i in range(self.requests):
+                request_start = time.perf_counter()
+                response = self._get(session, i)
+                latencies.append(time.perf_counter() - request_start)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+
+        threads = [threading.Thread(target=read, args=(next(sessions),)) for _ in range(clients)]
+        start = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            for connection in connections:
+                connection.close()
+        return dict(summarize(latencies, len(errors), time.perf_counter() - start), clients=clients, streams=streams)
+
+    def _pick_task(self, session, i):
+        return session['task_ids'][i % len(session['task_ids'])] if session['task_ids'] else 0
+
+    def _login(self, session, i):
+        return self.client.post('/user/login', data={'username': session['username'], 'password': self.PASSWORD})
+
+    def _create(self, session, i):
+        response = self.client.post('/tasks/create', headers=self._headers(session),
+                                    data={'heading': 'Bench %d' % i, 'description': 'Benchmark task %d' % i})
+        if response.status_code == 200:
+            session['created_ids'].append(response.get_json()['id'])
+        return response
+
+    def _list(self, session, i):
+        return self.client.get('/tasks', headers=self._headers(session))
+
+    def _get(self, session, i):
+        return self.client.get('/tasks/%d' % self._pick_task(session, i), headers=self._headers(session))
+
+    def _update(self, session, i):
+        return self.client.post('/tasks/%d/update' % self._pick_task(session, i), headers=self._headers(session),
+                                data={'is_completed': 'true' if i % 2 else 'false'})
+
+    def _delete(self, session, i):
+        if not session['created_ids']:
+            return None
+        return self.client.post('/tasks/%d/delete' % session['created_ids'].pop(), headers=self._headers(session))
+
+    def _refresh(self, session, i):
+        return self.client.post('/user/token/refresh', headers=self._headers(session, 'refresh_token'))
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
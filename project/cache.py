@@ -0,0 +1,121 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded, thread safe LRU cache. Each entry may carry its own time to live
+    in seconds; entries without one only leave the cache when evicted.
+    """
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        """
+        Sets the key only if it is absent or expired, atomically. Returns True if it was set.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def _set(self, key, value, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache:
+    """
+    Cache shared between processes, stored in redis as JSON. Takes any client with the
+    redis get/set/delete interface.
+    """
+    def __init__(self, client, ttl=None, prefix=''):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        value = self.client.get(self.prefix + str(key))
+        return default if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + str(key), json.dumps(value), ex=ttl)
+
+    def add(self, key, value, ttl=None):
+        """
+        Sets the key only if it is absent (SET NX). Returns True if it was set.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        return bool(self.client.set(self.prefix + str(key), json.dumps(value), ex=ttl, nx=True))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + str(key))
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+def create_cache(backend, size, ttl=None, redis_url=None, prefix=''):
+    """
+    Returns the cache for the configured backend: 'memory' for an in-process LRU,
+    'redis' for a cache shared by all processes, or None when caching is disabled.
+    """
+    if backend is None:
+        return None
+    if backend == 'memory':
+        return TTLCache(size, ttl=ttl)
+    if backend == 'redis':
+        import redis
+        return RedisCache(redis.Redis.from_url(redis_url), ttl=ttl, prefix=prefix)
+    raise ValueError("Unknown cache backend %s" % backend)
+
+
+def require_shared_cache(app, setting):
+    """
+    Refuses to start with the per process 'memory' backend for a store whose entries must be
+    seen by every worker process (WEB_CONCURRENCY), since each process would keep its own.
+    """
+    processes = app.config['WEB_CONCURRENCY']
+    if app.config[setting] == 'memory' and processes > 1:
+        raise RuntimeError("%s='memory' keeps a separate store in each of the %d worker processes; "
+                           "use 'redis'" % (setting, processes))
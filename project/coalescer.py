@@ -0,0 +1,147 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from project import db
+from project.schema import Task
+
+
+class PendingWrite:
+    def __init__(self, op, user_id, task_data):
+        self.op = op
+        self.user_id = user_id
+        self.task_data = task_data
+        self.future = Future()
+
+
+class WriteCoalescer:
+    """
+    Group commit for task creates and updates. Request threads queue their write and wait;
+    a flusher thread applies up to max_batch queued writes, waiting at most max_delay seconds
+    for more after the first, in a single transaction, then hands each request its own result.
+    If that transaction fails, the writes are retried one transaction each so only the
+    failing ones fail.
+    """
+    def __init__(self, app, max_batch, max_delay):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+
+    def _get_queue(self):
+        # The flusher thread is started on first use, and again in a forked child,
+        # since threads do not survive a fork.
+        with self._lock:
+            if self._queue is None or self._thread_pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread_pid = os.getpid()
+                threading.Thread(target=self._run, args=(self._queue,), daemon=True,
+                                 name='task-write-coalescer').start()
+            return self._queue
+
+    def _submit(self, op, user_id, task_data):
+        write = PendingWrite(op, user_id, task_data)
+        self._get_queue().put(write)
+        return write.future.result()
+
+    def create(self, user_id, heading, description):
+        """
+        :return: id of the new task
+        """
+        return self._submit('create', user_id, {'heading': heading, 'description': description,
+                                                'is_completed': False})
+
+    def update(self, id, user_id, heading=None, description=None, is_completed=None):
+        """
+        Same contract as Task.update_task
+        :return: the updated task row, or None if the user has no such task
+        """
+        task_data = {'heading': heading, 'description': description, 'is_completed': is_completed}
+        task_data = {column: value for column, value in task_data.items() if value is not None}
+        task_data['id'] = id
+        return self._submit('update', user_id, task_data)
+
+    def _run(self, pending):
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(pending.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            with self.app.app_context():
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    for write in batch:
+                        if not write.future.done():
+                            write.future.set_exception(e)
+                finally:
+                    db.session.remove()
+
+    def _flush(self, batch):
+        try:
+            results, updated_ids = self._apply(batch)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            for write in batch:
+                self._flush_one(write)
+            return
+        Task.invalidate_cache(updated_ids)
+        for write, result in zip(batch, results):
+            write.future.set_result(result)
+
+    @staticmethod
+    def _apply(batch):
+        """
+        Applies the writes of each user with Task.apply_batch, merging updates of the same task
+        in queue order, and reads back the updated rows with one query.
+        :return: result per write, ids of the updated tasks
+        """
+        by_user = OrderedDict()
+        for index, write in enumerate(batch):
+            by_user.setdefault(write.user_id, []).append((index, write))
+        results = [None] * len(batch)
+        updated = {}
+        for user_id, writes in by_user.items():
+            owned_ids = Task.get_owned_ids(user_id, [write.task_data['id'] for _, write in writes
+                                                     if write.op == 'update'])
+            creates, updates = [], OrderedDict()
+            for index, write in writes:
+                if write.op == 'create':
+                    creates.append((index, dict(write.task_data)))
+                elif write.task_data['id'] in owned_ids:
+                    updates.setdefault(write.task_data['id'], {}).update(write.task_data)
+                    updated[index] = write.task_data['id']
+            Task.apply_batch(user_id, [task_data for _, task_data in creates], list(updates.values()), [])
+            for index, task_data in creates:
+                results[index] = task_data['id']
+        if updated:
+            columns = [getattr(Task, field) for field in Task.FIELDS]
+            rows = {row.id: row for row in db.session.execute(
+                db.select(*columns).where(Task.id.in_(set(updated.values()))))}
+            for index, id in updated.items():
+                results[index] = rows[id]
+        return results, list(set(updated.values()))
+
+    @staticmethod
+    def _flush_one(write):
+        try:
+            if write.op == 'create':
+                task = Task(user_id=write.user_id, **write.task_data)
+                task.save()
+                result = task.id
+            else:
+                task_data = dict(write.task_data)
+                result = Task.update_task(id=task_data.pop('id'), user_id=write.user_id, **task_data)
+        except Exception as e:
+            db.session.rollback()
+            write.future.set_exception(e)
+        else:
+            write.future.set_result(result)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 class BaseConfig:
     """Base configuration"""
@@ -8,6 +9,88 @@ class BaseConfig:
     JWT_SECRET_KEY = "todotasks9988776655"
     JWT_BLACKLIST_ENABLED = True
     JWT_BLACKLIST_TOKEN_CHECKS = ['access', 'refresh']
+    DATABASE_POOL_SIZE = 5
+    DATABASE_MAX_OVERFLOW = 10
+    DATABASE_POOL_RECYCLE = 1800
+    DATABASE_POOL_PRE_PING = True
+    # Read replicas used by GET requests, e.g. DATABASE_REPLICA_URLS=sqlite:///r1.db,sqlite:///r2.db
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if uri]
+    # Worker processes serving the app; gunicorn.conf.py sets it. Stores that every process must
+    # share refuse the per process 'memory' backend when it is above 1.
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+    # How long a user keeps reading from the primary after a write, to cover replication lag.
+    # The recent writers are kept in 'memory' (one process only) or 'redis' (shared).
+    REPLICA_READ_YOUR_WRITES_SECONDS = 5
+    REPLICA_RECENT_WRITERS_SIZE = 100000
+    REPLICA_RECENT_WRITERS_REDIS_URL = os.environ.get('REPLICA_RECENT_WRITERS_REDIS_URL',
+                                                      os.environ.get('TASK_CACHE_REDIS_URL'))
+    REPLICA_RECENT_WRITERS_BACKEND = 'redis' if REPLICA_RECENT_WRITERS_REDIS_URL else 'memory'
+    # Applied to every new SQLite connection. WAL lets readers run alongside the writer,
+    # and busy_timeout (ms) makes writers wait for the lock instead of failing.
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 268435456
+    }
+    TASKS_PAGE_SIZE_DEFAULT = 50
+    TASKS_PAGE_SIZE_MAX = 500
+    TASKS_BATCH_MAX_OPERATIONS = 500
+    TASKS_EXPORT_CHUNK_SIZE = 1000
+    TASKS_IMPORT_CHUNK_SIZE = 1000
+    TASKS_IMPORT_MAX_ERRORS = 1000
+    # Deleted tasks are reported to delta sync for TASK_TOMBSTONE_RETENTION seconds; clients with
+    # an older cursor must resync. Expired tombstones are purged every TASK_TOMBSTONE_PURGE_INTERVAL.
+    TASK_TOMBSTONE_RETENTION = 30 * 24 * 60 * 60
+    TASK_TOMBSTONE_PURGE_INTERVAL = 3600
+    REVOKED_TOKENS_CACHE_SIZE = 100000
+    # Seconds a "not revoked" answer is trusted before the table is asked again.
+    # Revocations made by this process are seen immediately.
+    REVOKED_TOKENS_NEGATIVE_TTL = 30
+    REVOKED_TOKENS_PURGE_INTERVAL = 300
+    # GetTask read-through cache: 'memory' (per process LRU), 'redis' (shared, needs the
+    # redis package and TASK_CACHE_REDIS_URL) or None to disable.
+    TASK_CACHE_BACKEND = 'memory'
+    TASK_CACHE_SIZE = 10000
+    TASK_CACHE_TTL = 60
+    # Seconds a write keeps the task out of the cache, so a read that loaded the row before
+    # the write committed cannot cache it afterwards. Must exceed the slowest GetTask read.
+    TASK_CACHE_INVALIDATION_TTL = 5
+    TASK_CACHE_REDIS_URL = os.environ.get('TASK_CACHE_REDIS_URL')
+    # Responses stored for Idempotency-Key retries of task creates and updates: 'memory' (one
+    # process only), 'redis' (shared, used when IDEMPOTENCY_REDIS_URL is set) or None to ignore
+    # the header. A key is claimed for IDEMPOTENCY_CLAIM_TTL seconds while its request runs, so a
+    # request killed with its worker frees the key once the worker timeout has passed; the
+    # response of a successful one is kept for IDEMPOTENCY_KEY_TTL.
+    IDEMPOTENCY_REDIS_URL = os.environ.get('IDEMPOTENCY_REDIS_URL', os.environ.get('TASK_CACHE_REDIS_URL'))
+    IDEMPOTENCY_BACKEND = 'redis' if IDEMPOTENCY_REDIS_URL else 'memory'
+    IDEMPOTENCY_STORE_SIZE = 100000
+    IDEMPOTENCY_CLAIM_TTL = int(os.environ.get('WORKER_TIMEOUT', 30))
+    IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+    # Threads of the async serving mode (asgi.py) running the requests it hands to the Flask app
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+    # Group commit: queue concurrent task creates and updates and commit them together, at most
+    # TASK_WRITE_BATCH_SIZE writes per transaction, waiting up to TASK_WRITE_BATCH_DELAY seconds
+    # for more after the first.
+    TASK_WRITE_COALESCING = os.environ.get('TASK_WRITE_COALESCING', '').lower() in ('1', 'true', 'yes')
+    TASK_WRITE_BATCH_SIZE = 100
+    TASK_WRITE_BATCH_DELAY = 0.005
+    # Task change event streams: seconds between polls of the subscribed users' tasks versions,
+    # which is how writes made by other processes reach a stream, seconds between keepalive
+    # comments on an idle stream, and changes a slow stream may fall behind before it is reset.
+    TASK_EVENTS_POLL_INTERVAL = 1.0
+    TASK_EVENTS_HEARTBEAT = 15
+    TASK_EVENTS_QUEUE_SIZE = 1000
+    PASSWORD_HASH_ROUNDS = 29000
+    # Processes hashing passwords; 0 hashes inline in the request worker.
+    PASSWORD_HASH_WORKERS = os.cpu_count() or 1
+    # Hashing jobs allowed to wait for or run in the pool before requests are rejected with 503.
+    PASSWORD_HASH_MAX_PENDING = 4 * (os.cpu_count() or 1)
+    # Fraction of requests run under cProfile; 0 disables profiling. The stats of sampled
+    # requests slower than PROFILE_SLOW_REQUEST_SECONDS are dumped to PROFILE_DIR.
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_SLOW_REQUEST_SECONDS = float(os.environ.get('PROFILE_SLOW_REQUEST_SECONDS', 1))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'todolist-profiles'))
 
 
 class DevelopmentConfig(BaseConfig):
@@ -19,8 +102,18 @@ class TestingConfig(BaseConfig):
     """Testing configuration"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_TEST_URL')
+    SQLALCHEMY_REPLICA_URIS = []
+
+
+class BenchmarkConfig(BaseConfig):
+    """Benchmark configuration, on a local SQLite database that is recreated by every run"""
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'DATABASE_BENCHMARK_URL', 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'todotasks_benchmark.db'))
+    SQLALCHEMY_REPLICA_URIS = []
 
 
 class ProductionConfig(BaseConfig):
     """Production configuration"""
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    DATABASE_POOL_SIZE = 20
+    DATABASE_MAX_OVERFLOW = 40
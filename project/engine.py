@@ -0,0 +1,69 @@
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# asyncio drivers of the backends the async serving mode supports
+ASYNC_DRIVERS = {'sqlite': 'aiosqlite', 'postgresql': 'asyncpg'}
+
+
+def is_sqlite(uri):
+    return uri is not None and make_url(uri).get_backend_name() == 'sqlite'
+
+
+def get_engine_options(uri, config):
+    """
+    Returns the SQLAlchemy engine options for the database at uri from the DATABASE_POOL_*
+    settings. SQLite file databases keep a pool of connections too, so the pragmas set on
+    connect are paid once per connection rather than once per request.
+    """
+    if uri is None:
+        return {}
+    if is_sqlite(uri):
+        if make_url(uri).database in (None, '', ':memory:'):
+            return {}
+        return {
+            'poolclass': QueuePool,
+            'pool_size': config['DATABASE_POOL_SIZE'],
+            'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+            'connect_args': {'check_same_thread': False}
+        }
+    return {
+        'pool_size': config['DATABASE_POOL_SIZE'],
+        'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+        'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+        'pool_pre_ping': config['DATABASE_POOL_PRE_PING']
+    }
+
+
+def get_async_database_url(uri):
+    """
+    Returns the URL of the database at uri through its asyncio driver, e.g. sqlite+aiosqlite://
+    :raises ValueError: if the backend has no supported asyncio driver
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError("No asyncio driver for %s databases, use one of %s" % (backend, ', '.join(ASYNC_DRIVERS)))
+    return url.set(drivername='%s+%s' % (backend, ASYNC_DRIVERS[backend]))
+
+
+def get_async_engine_options(uri, config):
+    """
+    get_engine_options for an asyncio engine, whose pool must be the asyncio adapted one
+    """
+    options = get_engine_options(uri, config)
+    if options.get('poolclass') is QueuePool:
+        options['poolclass'] = AsyncAdaptedQueuePool
+    return options
+
+
+def set_sqlite_pragmas(engine, pragmas):
+    """
+    Runs "PRAGMA name=value" for each of pragmas on every new connection of engine.
+    """
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s=%s' % (name, value))
+        cursor.close()
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import deque
+from project import db
+from project.schema import User, Task
+
+logger = logging.getLogger(__name__)
+
+# Users whose tasks versions are read per query while polling
+POLL_CHUNK_SIZE = 500
+
+
+def format_event(event):
+    """
+    Formats a (change_seq, op, data) change as a Server-Sent Event whose id is the change sequence
+    number, so a reconnecting client resumes from it with Last-Event-ID.
+    """
+    change_seq, op, data = event
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (change_seq, op, json.dumps(data))
+
+
+class Subscription:
+    """
+    One open event stream. Holds the changes published to it until the stream takes them.
+    A subscriber that falls more than maxsize changes behind is marked overflowed instead.
+    """
+    def __init__(self, user_id, cursor, maxsize):
+        self.user_id = user_id
+        # change sequence number of the user's tasks when the stream subscribed
+        self.cursor = cursor
+        self.maxsize = maxsize
+        self.overflowed = False
+        self._events = deque()
+        self._condition = threading.Condition()
+
+    def push(self, events):
+        with self._condition:
+            if len(self._events) + len(events) > self.maxsize:
+                self.overflowed = True
+                self._events.clear()
+            else:
+                self._events.extend(events)
+            self._condition.notify()
+
+    def wait(self, timeout):
+        """
+        Returns the changes published since the last call, waiting up to timeout seconds for one
+        """
+        with self._condition:
+            if not self._events and not self.overflowed:
+                self._condition.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+
+class AsyncSubscription(Subscription):
+    """
+    Subscription read by a stream served on an asyncio event loop: the poller thread wakes the
+    stream through the loop, so waiting for changes does not hold a thread.
+    """
+    def __init__(self, user_id, cursor, maxsize, loop):
+        super().__init__(user_id, cursor, maxsize)
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def push(self, events):
+        super().push(events)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # the loop closed; the stream is gone
+            pass
+
+    async def wait_async(self, timeout):
+        """
+        Returns the changes published since the last call, waiting up to timeout seconds for one
+        """
+        if not self._events and not self.overflowed:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._ready.clear()
+        return self.wait(0)
+
+
+class TaskEventHub:
+    """
+    Fans the changes to users' tasks out to their open event streams in this process.
+
+    A poller thread reads the tasks version of every user with an open stream, one query per
+    poll_interval seconds however many streams are open, and publishes the changes of those
+    whose version moved. The version is bumped by every task write in any process, so this is
+    also how writes made by other workers or servers reach the streams. Writes made in this
+    process call notify to be published without waiting for the next poll.
+    """
+    def __init__(self, app, poll_interval, queue_size):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self._subscriptions = {}
+        self._cursors = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread_pid = None
+
+    def _ensure_poller(self):
+        # Started on first use, and again in a forked child, since threads do not survive a fork.
+        # Called with the lock held.
+        if self._thread_pid != os.getpid():
+            self._thread_pid = os.getpid()
+            self._subscriptions = {}
+            self._cursors = {}
+            threading.Thread(target=self._run, daemon=True, name='task-event-hub').start()
+
+    def subscribe(self, user_id, cursor=None, loop=None):
+        """
+        Opens a subscription to the user's task changes made from now on. A caller that already
+        read the user's tasks version passes it as cursor. With loop, the subscription is an
+        AsyncSubscription for a stream served on that event loop.
+        """
+        with self._lock:
+            self._ensure_poller()
+            if user_id not in self._cursors:
+                self._cursors[user_id] = User.get_tasks_version(user_id) if cursor is None else cursor
+            if loop is None:
+                subscription = Subscription(user_id, self._cursors[user_id], self.queue_size)
+            else:
+                subscription = AsyncSubscription(user_id, self._cursors[user_id], self.queue_size, loop)
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.user_id, None)
+                self._cursors.pop(subscription.user_id, None)
+
+    def notify(self, user_id):
+        """
+        Tells the poller the user's tasks changed in this process
+        """
+        if user_id in self._cursors:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            with self._lock:
+                cursors = dict(self._cursors)
+            if not cursors:
+                continue
+            with self.app.app_context():
+                try:
+                    self.poll(cursors)
+                except Exception:
+                    logger.exception("Failed to poll task changes")
+                finally:
+                    db.session.remove()
+
+    def poll(self, cursors):
+        """
+        Publishes the changes of the users whose tasks version moved past their cursor
+        """
+        user_ids = list(cursors)
+        for start in range(0, len(user_ids), POLL_CHUNK_SIZE):
+            versions = User.get_tasks_versions(user_ids[start:start + POLL_CHUNK_SIZE])
+            for user_id, version in versions.items():
+                if version <= cursors[user_id]:
+                    continue
+                events = Task.get_change_log(user_id, cursors[user_id], version)
+                with self._lock:
+                    if self._cursors.get(user_id) != cursors[user_id]:
+                        # all its streams closed meanwhile
+                        continue
+                    self._cursors[user_id] = version
+                    subscriptions = list(self._subscriptions.get(user_id, ()))
+                for subscription in subscriptions:
+                    subscription.push(events)
@@ -0,0 +1,62 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from passlib.hash import pbkdf2_sha256 as sha256
+
+
+class HashingPoolFull(Exception):
+    """Raised when the hashing pool already has its maximum number of pending jobs"""
+
+
+def _hash(password, rounds):
+    return sha256.using(rounds=rounds).hash(password)
+
+
+def _verify(password, hash):
+    return sha256.verify(password, hash)
+
+
+class PasswordHasher:
+    """
+    Runs pbkdf2_sha256 hashing in a dedicated, size limited process pool so password
+    hashing cannot starve the request workers. With workers=0 hashing runs inline.
+    """
+    def __init__(self, rounds, workers, max_pending):
+        self.rounds = rounds
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max_pending) if max_pending > 0 else None
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # The pool is created on first use, and again in a forked child, since
+        # executors cannot be shared across processes.
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        if self.workers == 0:
+            return fn(*args)
+        if self._slots is None or not self._slots.acquire(blocking=False):
+            raise HashingPoolFull()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def verify(self, password, hash):
+        return self._run(_verify, password, hash)
+
+    def needs_update(self, hash):
+        """Returns True if hash was made with other cost settings than the configured ones"""
+        return sha256.using(rounds=self.rounds).needs_update(hash)
@@ -0,0 +1,56 @@
+import hashlib
+from functools import wraps
+from flask import current_app, request
+from flask_restful import abort
+from flask_restful.utils import unpack
+from project.tokens import Tokens
+
+MAX_KEY_LENGTH = 255
+
+
+def idempotent(fn):
+    """
+    Makes a jwt protected POST handler honour the Idempotency-Key header. The first successful
+    response for a user, path and key is stored; retries with the same key and body get it back
+    with an "Idempotent-Replayed: true" header, without running the handler again. A key reused
+    with another body is rejected with 422, and one whose first request is still running with 409.
+    The key is only claimed for IDEMPOTENCY_CLAIM_TTL while the request runs, so a request that
+    dies with its worker does not hold it for long. Failed requests are not stored, so they can be
+    retried with the same key.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        store = current_app.extensions['idempotency_store']
+        if key is None or store is None:
+            return fn(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            abort(400, description="Idempotency-Key must be 1 to %d characters" % MAX_KEY_LENGTH)
+
+        store_key = '%s:%s:%s' % (Tokens.get_user_id(), request.path, key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        claim_ttl = current_app.config['IDEMPOTENCY_CLAIM_TTL']
+        if not store.add(store_key, {'fingerprint': fingerprint}, ttl=claim_ttl):
+            stored = store.get(store_key)
+            if stored is not None:
+                if stored['fingerprint'] != fingerprint:
+                    abort(422, description="Idempotency-Key was already used with a different request")
+                if 'status' not in stored:
+                    abort(409, description="A request with this Idempotency-Key is in progress")
+                return stored['data'], stored['status'], {'Idempotent-Replayed': 'true'}
+            # the entry expired in between; claim the key again, unless another retry just did
+            if not store.add(store_key, {'fingerprint': fingerprint}, ttl=claim_ttl):
+                abort(409, description="A request with this Idempotency-Key is in progress")
+
+        try:
+            data, status, headers = unpack(fn(*args, **kwargs))
+        except:
+            store.delete(store_key)
+            raise
+        if 200 <= status < 300:
+            store.set(store_key, {'fingerprint': fingerprint, 'data': data, 'status': status},
+                      ttl=current_app.config['IDEMPOTENCY_KEY_TTL'])
+        else:
+            store.delete(store_key)
+        return data, status, headers
+    return wrapper
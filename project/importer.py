@@ -0,0 +1,78 @@
+import csv
+import json
+from project.parsers import Parser
+from project.schema import Task
+
+
+class TaskImporter:
+    """
+    Loads tasks for one user from NDJSON or CSV lines. Rows are validated like CreateTask
+    requests and inserted chunk_size at a time; invalid rows are reported and skipped.
+    """
+    FORMATS = ('ndjson', 'csv')
+
+    def __init__(self, user_id, chunk_size, max_errors):
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    @staticmethod
+    def _decode(lines):
+        for line in lines:
+            yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+    @staticmethod
+    def _read_ndjson(lines):
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, None
+
+    @staticmethod
+    def _read_csv(lines):
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+
+    def _add_error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line_number, 'message': message})
+
+    def _flush(self, chunk):
+        if chunk:
+            Task.bulk_create(self.user_id, chunk)
+            self.imported += len(chunk)
+
+    def run(self, lines, format):
+        """
+        :param lines: iterable of str or bytes lines
+        :param format: one of TaskImporter.FORMATS
+        :return: summary dict with the imported and failed counts and the first max_errors errors
+        """
+        read = self._read_ndjson if format == 'ndjson' else self._read_csv
+        chunk = []
+        for line_number, row in read(self._decode(lines)):
+            if row is None:
+                self._add_error(line_number, "Invalid JSON")
+                continue
+            try:
+                chunk.append(Parser.parse_import_row(row))
+            except ValueError as e:
+                self._add_error(line_number, str(e))
+                continue
+            if len(chunk) >= self.chunk_size:
+                self._flush(chunk)
+                chunk = []
+        self._flush(chunk)
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors
+        }
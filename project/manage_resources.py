@@ -1,5 +1,5 @@
 from flask_restful import Api
-from project import user_resources, task_resources
+from project import user_resources, task_resources, metrics_resources
 
 
 class ResourcesManager():
@@ -17,5 +17,14 @@ class ResourcesManager():
         api.add_resource(task_resources.CreateTask, '/tasks/create')
         api.add_resource(task_resources.GetTask, '/tasks/<int:id>')
         api.add_resource(task_resources.ListTasks, '/tasks')
+        api.add_resource(task_resources.BatchTasks, '/tasks/batch')
+        api.add_resource(task_resources.ListTaskChanges, '/tasks/changes')
+        api.add_resource(task_resources.TaskEvents, '/tasks/events')
+        api.add_resource(task_resources.TaskSummary, '/tasks/summary')
+        api.add_resource(task_resources.SearchTasks, '/tasks/search')
+        api.add_resource(task_resources.ExportTasks, '/tasks/export')
+        api.add_resource(task_resources.ImportTasks, '/tasks/import')
         api.add_resource(task_resources.UpdateTask, '/tasks/<int:id>/update')
-        api.add_resource(task_resources.DeleteTask, '/tasks/<int:id>/delete')
\ No newline at end of file
+        api.add_resource(task_resources.DeleteTask, '/tasks/<int:id>/delete')
+
+        api.add_resource(metrics_resources.ExportMetrics, '/metrics')
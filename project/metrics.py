@@ -0,0 +1,204 @@
+import bisect
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request, has_app_context, has_request_context, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+VALIDATION_BUCKETS = (.00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .005, .01)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels)
+
+
+class Histogram:
+    """
+    Thread safe histogram of observations per label values, rendered in the Prometheus text format
+    """
+    def __init__(self, name, documentation, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # per bucket counts (the last one is +Inf), sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def total(self):
+        """
+        :return: count and sum of the observations of all label values
+        """
+        with self._lock:
+            return (sum(sum(counts) for counts, _ in self._series.values()),
+                    sum(total for _, total in self._series.values()))
+
+    def collect(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            labels = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (self.name, _format_labels(labels + [('le', bound)]), cumulative))
+            lines.append('%s_sum%s %r' % (self.name, _format_labels(labels), total))
+            lines.append('%s_count%s %d' % (self.name, _format_labels(labels), cumulative))
+        return lines
+
+
+class Metrics:
+    """
+    The service's metrics of one process
+    """
+    def __init__(self):
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Request latency by route.', ('method', 'route', 'status'))
+        self.request_sql_queries = Histogram(
+            'http_request_sql_queries', 'SQL statements executed per request by route.', ('method', 'route'),
+            buckets=QUERY_COUNT_BUCKETS)
+        self.request_sql_duration = Histogram(
+            'http_request_sql_duration_seconds', 'Time spent executing SQL per request by route.',
+            ('method', 'route'))
+        self.password_hash_duration = Histogram(
+            'password_hash_duration_seconds', 'Time spent hashing and verifying passwords, including '
+            'waiting for the hashing pool.', ('operation',))
+        self.jwt_verify_duration = Histogram(
+            'jwt_verify_duration_seconds', 'Time spent decoding and checking JWTs, including the '
+            'revocation check.', ('token_type',))
+        self.request_validation_duration = Histogram(
+            'request_validation_duration_seconds', 'Time spent reading and validating request '
+            'parameters by route.', ('route',), buckets=VALIDATION_BUCKETS)
+
+    @contextmanager
+    def time(self, histogram, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = []
+        for histogram in (self.request_duration, self.request_sql_queries, self.request_sql_duration,
+                          self.password_hash_duration, self.jwt_verify_duration,
+                          self.request_validation_duration):
+            lines.extend(histogram.collect())
+        return '\n'.join(lines) + '\n'
+
+
+def get_metrics():
+    return current_app.extensions.get('metrics') if has_app_context() else None
+
+
+@contextmanager
+def timed(histogram_name, **labels):
+    """
+    Times the block into the named histogram of the current app's metrics, if any
+    """
+    metrics = get_metrics()
+    if metrics is None:
+        yield
+        return
+    with metrics.time(getattr(metrics, histogram_name), **labels):
+        yield
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's own context, so a statement that raises leaves nothing behind
+    context._query_start_time = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_start_time
+    if has_request_context() and 'sql_queries' in g:
+        g.sql_queries += 1
+        g.sql_seconds += elapsed
+
+
+def request_route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def init_metrics(app):
+    """
+    Registers the request hooks recording the latency, SQL statement count and SQL time of
+    every request by route. With PROFILE_SAMPLE_RATE > 0 that fraction of requests runs under
+    cProfile, and the stats of those slower than PROFILE_SLOW_REQUEST_SECONDS are dumped
+    to PROFILE_DIR.
+    """
+    app.extensions['metrics'] = Metrics()
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_start_time = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_seconds = 0.0
+        sample_rate = app.config['PROFILE_SAMPLE_RATE']
+        if sample_rate and random.random() < sample_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiler is already active in this thread
+                return
+            g.profiler = profiler
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_start_time' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_start_time
+        method, route = request.method, request_route()
+        metrics = app.extensions['metrics']
+        metrics.request_duration.observe(elapsed, method=method, route=route, status=response.status_code)
+        metrics.request_sql_queries.observe(g.sql_queries, method=method, route=route)
+        metrics.request_sql_duration.observe(g.sql_seconds, method=method, route=route)
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if elapsed >= app.config['PROFILE_SLOW_REQUEST_SECONDS']:
+                dump_profile(profiler, app.config['PROFILE_DIR'], method, route, elapsed)
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exception):
+        # after_request is skipped when the request failed with an unhandled exception
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+
+def dump_profile(profiler, directory, method, route, elapsed):
+    """
+    Writes the cProfile stats of a slow request, readable with pstats or snakeviz
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = '%d-%s-%s-%dms.prof' % (time.time() * 1000, method, route.strip('/').replace('/', '_') or 'root',
+                                   elapsed * 1000)
+    profiler.dump_stats(os.path.join(directory, name.replace('<', '').replace('>', '').replace(':', '_')))
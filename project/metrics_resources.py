@@ -0,0 +1,13 @@
+from flask_restful import Resource
+from flask import current_app, Response
+
+
+class ExportMetrics(Resource):
+    """
+    Returns the metrics of this process in the Prometheus text format, for scraping.
+    Endpoint is not jwt protected
+    """
+
+    def get(self):
+        return Response(current_app.extensions['metrics'].render(),
+                        mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -1,23 +1,193 @@
-from flask_restful import reqparse
+from collections import namedtuple
+from flask import request
+from flask_restful import abort, inputs
+from project.metrics import request_route, timed
+from project.schema import Task
+
+MISSING_PARAMETER = "Missing required parameter in the JSON body or the post body or the query string"
+
+
+def text(value):
+    if not isinstance(value, str):
+        raise ValueError("must be a string")
+    return value
+
+
+def identifier(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("must be an integer")
+    return value
+
+
+def boolean(value):
+    """
+    Accepts JSON booleans as well as the strings understood by flask_restful.inputs.boolean,
+    so "False" is converted to False rather than being truthy.
+    """
+    if not isinstance(value, (bool, str)):
+        raise ValueError("must be a boolean")
+    return inputs.boolean(value)
+
+
+def task_fields(value):
+    """
+    Parses a comma separated list of task fields, e.g. "id,heading"
+    """
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in Task.FIELDS]
+    if not fields or unknown:
+        raise ValueError("fields must be a comma separated list of %s" % ', '.join(Task.FIELDS))
+    return fields
+
+
+def search_text(value):
+    if not value.split():
+        raise ValueError("q must contain at least one word")
+    return value
+
+
+Field = namedtuple('Field', ['name', 'type', 'required', 'default'])
+Field.__new__.__defaults__ = (text, False, None)
+
+
+class ValidationError(ValueError):
+    """
+    Raised by Schema.validate, errors maps each invalid field to its message
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join('%s: %s' % item for item in sorted(errors.items())))
+
+
+class Schema:
+    """
+    A request schema, built once at import time and reused by every request.
+    Checks and converts all fields in a single pass over the request data.
+    location is "body" (JSON body, else form and query string) or "args" (query string only)
+    """
+
+    def __init__(self, *fields, location='body'):
+        self.fields = fields
+        self.location = location
+
+    def validate(self, data):
+        """
+        :param data: mapping of raw values
+        :return: dict with every field of the schema, converted or defaulted
+        :raises ValidationError: if fields are missing or fail conversion
+        """
+        parsed = {}
+        errors = {}
+        for name, type, required, default in self.fields:
+            value = data.get(name)
+            if value is None:
+                if required:
+                    errors[name] = MISSING_PARAMETER
+                parsed[name] = default
+                continue
+            try:
+                parsed[name] = type(value)
+            except (TypeError, ValueError) as e:
+                errors[name] = str(e)
+        if errors:
+            raise ValidationError(errors)
+        return parsed
+
+    def parse_args(self):
+        """
+        Validates the current request, aborting with 400 on invalid input. The time spent,
+        including reading the body, is recorded in the request_validation_duration histogram.
+        """
+        with timed('request_validation_duration', route=request_route()):
+            if self.location == 'args':
+                data = request.args
+            elif request.is_json:
+                data = request.get_json(silent=True)
+                if not isinstance(data, dict):
+                    data = {}
+            else:
+                data = request.values
+            try:
+                return self.validate(data)
+            except ValidationError as e:
+                errors = e.errors
+        abort(400, message=errors)
+
+
+HEADING = Field('heading', required=True)
+DESCRIPTION = Field('description', required=True)
+TASK_ID = Field('id', identifier, required=True)
+IS_COMPLETED = Field('is_completed', boolean)
+PAGE_LIMIT = Field('limit', inputs.positive)
+
 
 class Parser:
     """"
-    Returns Parsers for REST Requests
+    Request schemas for REST Requests, built once at import time
     """
+    register_user = Schema(Field('username', required=True), Field('password', required=True),
+                           Field('email', required=True))
+    login_user = Schema(Field('username', required=True), Field('password', required=True))
+    update_user = Schema(Field('email'))
+
+    create_task = Schema(HEADING, DESCRIPTION)
+    update_task = Schema(Field('heading'), Field('description'), IS_COMPLETED)
+    delete_task = Schema(TASK_ID)
+    import_task = Schema(HEADING, DESCRIPTION, IS_COMPLETED)
+
+    get_task = Schema(Field('fields', task_fields), location='args')
+    list_tasks = Schema(
+        Field('cursor', inputs.natural),
+        PAGE_LIMIT,
+        Field('is_completed', inputs.boolean),
+        Field('min_id', inputs.natural),
+        Field('max_id', inputs.natural),
+        Field('fields', task_fields),
+        location='args'
+    )
+    search_tasks = Schema(Field('q', search_text, required=True), PAGE_LIMIT,
+                          Field('offset', inputs.natural, default=0), location='args')
+    task_changes = Schema(Field('since', inputs.natural), PAGE_LIMIT, location='args')
+
+    batch_operations = {
+        'create': create_task,
+        'update': Schema(TASK_ID, *update_task.fields),
+        'delete': delete_task
+    }
+
     @staticmethod
-    def get_user_parser(id_req=False, username_req=True, password_req=False, email_req=False):
-        user_parser = reqparse.RequestParser()
-        user_parser.add_argument('id', required=id_req)
-        user_parser.add_argument('username', required=username_req)
-        user_parser.add_argument('password', required=password_req)
-        user_parser.add_argument('email', required=email_req)
-        return user_parser
+    def parse_batch_operation(operation):
+        """
+        Validates one operation of a batch request with the same schemas as the single task endpoints.
+        :param operation: dict with "op" in {"create", "update", "delete"}
+        :return: op, dict of task columns to write (including "id" for update and delete)
+        :raises ValueError: if the operation is invalid
+        """
+        if not isinstance(operation, dict):
+            raise ValueError("Operation must be an object")
+        op = operation.get('op')
+        if op not in Parser.batch_operations:
+            raise ValueError("op must be one of create, update, delete")
+
+        parsed = Parser.batch_operations[op].validate(operation)
+        task_data = {field: value for field, value in parsed.items() if value is not None}
+        if op == 'create':
+            task_data['is_completed'] = False
+        return op, task_data
 
     @staticmethod
-    def get_tasks_parser(id_req=True, heading_req=False, desc_req=False, status_req=False):
-        task_parser = reqparse.RequestParser()
-        task_parser.add_argument('id', required=id_req)
-        task_parser.add_argument('heading', required=heading_req)
-        task_parser.add_argument('description', required=desc_req)
-        task_parser.add_argument('is_completed', required=status_req)
-        return task_parser
+    def parse_import_row(row):
+        """
+        Validates one imported task like a create request, additionally accepting "is_completed".
+        :return: dict of task columns to insert
+        :raises ValueError: if the row is invalid
+        """
+        if not isinstance(row, dict):
+            raise ValueError("Row must be an object")
+        if row.get('is_completed') == '':
+            # empty CSV cell
+            row = dict(row, is_completed=None)
+        task_data = Parser.import_task.validate(row)
+        task_data['is_completed'] = bool(task_data['is_completed'])
+        return task_data
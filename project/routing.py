@@ -0,0 +1,98 @@
+import random
+from flask import current_app, g, request, has_request_context
+from flask_jwt_extended import decode_token
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, orm
+from sqlalchemy.sql.dml import UpdateBase
+from project.cache import create_cache, require_shared_cache
+from project.engine import get_engine_options, is_sqlite, set_sqlite_pragmas
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that sends the reads of a request to the replica chosen for it, if any.
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary, and pin
+    the rest of the request to it.
+    """
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('replica_engine') if has_request_context() else None
+        if replica is not None:
+            if not self._flushing and not isinstance(clause, UpdateBase):
+                return replica
+            g.replica_engine = None
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def get_request_user_id():
+    """
+    Returns the user id claimed by the request's bearer token, or None if it has no valid one.
+    Only used to route reads; the endpoints still verify the token themselves.
+    """
+    authorization = request.headers.get('Authorization', '')
+    if not authorization.startswith('Bearer '):
+        return None
+    try:
+        claims = decode_token(authorization[len('Bearer '):])
+    except Exception:
+        return None
+    return claims.get(current_app.config['JWT_USER_CLAIMS'], {}).get('user_id')
+
+
+def is_reading_from_replica():
+    return has_request_context() and g.get('replica_engine') is not None
+
+
+def init_replicas(app):
+    """
+    Creates the engines for SQLALCHEMY_REPLICA_URIS and registers the request hooks that
+    route safe (GET, HEAD, OPTIONS) requests to a random replica. To read its own writes,
+    a user who made an unsafe request less than REPLICA_READ_YOUR_WRITES_SECONDS ago keeps
+    reading from the primary, whichever token, device or worker process the read comes from.
+    With several worker processes the recent writers must be kept in a shared store.
+    """
+    replicas = []
+    for uri in app.config['SQLALCHEMY_REPLICA_URIS']:
+        engine = create_engine(uri, **get_engine_options(uri, app.config))
+        if is_sqlite(uri):
+            set_sqlite_pragmas(engine, app.config['SQLITE_PRAGMAS'])
+        replicas.append(engine)
+    app.extensions['replica_engines'] = replicas
+    if replicas:
+        require_shared_cache(app, 'REPLICA_RECENT_WRITERS_BACKEND')
+    app.extensions['replica_recent_writers'] = create_cache(
+        app.config['REPLICA_RECENT_WRITERS_BACKEND'],
+        size=app.config['REPLICA_RECENT_WRITERS_SIZE'],
+        ttl=app.config['REPLICA_READ_YOUR_WRITES_SECONDS'],
+        redis_url=app.config['REPLICA_RECENT_WRITERS_REDIS_URL'],
+        prefix='recent-writer:'
+    )
+
+    @app.before_request
+    def choose_replica():
+        g.replica_engine = None
+        replicas = app.extensions['replica_engines']
+        if not replicas or request.method not in SAFE_METHODS:
+            return
+        user_id = get_request_user_id()
+        if user_id is None:
+            # a token without a user id cannot be matched to its writes
+            if 'Authorization' in request.headers:
+                return
+        elif app.extensions['replica_recent_writers'].get(user_id):
+            return
+        g.replica_engine = random.choice(replicas)
+
+    @app.after_request
+    def remember_writer(response):
+        if app.extensions['replica_engines'] and request.method not in SAFE_METHODS:
+            user_id = get_request_user_id()
+            if user_id is not None:
+                app.extensions['replica_recent_writers'].set(user_id, True)
+        return response
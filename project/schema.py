@@ -1,5 +1,18 @@
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import orm
 from project import db
-from passlib.hash import pbkdf2_sha256 as sha256
+from project.metrics import timed
+from project.routing import is_reading_from_replica
+from project.search import FTS_TABLE, register_search_index, to_match_query
+
+def supports_returning():
+    """
+    Whether UPDATE ... RETURNING can be used. The dialect flag only exists in SQLAlchemy 1.4.
+    """
+    return getattr(db.engine.dialect, 'full_returning', False)
+
 
 class User(db.Model):
     __tablename__ = 'user'
@@ -7,6 +20,15 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(80), nullable=False)
+    # Bumped in the same transaction as every write to the user's tasks. Doubles as the
+    # sequence number of that write for delta sync.
+    tasks_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Task counters, kept up to date by every task write in the same transaction
+    tasks_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    tasks_completed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Highest change sequence number of the user's purged tombstones. Delta sync from an older
+    # cursor would miss those deletions.
+    tombstones_purged_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     tasks = db.relationship('Task', backref='owner')
 
     def save(self):
@@ -26,9 +48,8 @@ class User(db.Model):
         return cls.query.filter_by(email=email).first()
 
     @classmethod
-    def update_user(cls, username, email):
-        user = cls.query.filter_by(username=username).first()
-        user.email = email
+    def update_user(cls, id, email):
+        cls.query.filter_by(id=id).update({'email': email})
         db.session.commit()
 
     @classmethod
@@ -37,55 +58,638 @@ class User(db.Model):
         db.session.delete(user)
         db.session.commit()
 
+    @classmethod
+    def select_tasks_version(cls, id):
+        return db.select(cls.tasks_version).where(cls.id == id)
+
+    @classmethod
+    def get_tasks_version(cls, id):
+        return db.session.execute(cls.select_tasks_version(id)).scalar()
+
+    @classmethod
+    def next_tasks_version(cls, id, total_delta=0, completed_delta=0):
+        """
+        Bumps the user's tasks version and adjusts the task counters in the current transaction,
+        and returns the new version. The row update serializes concurrent writers of the same
+        user, so versions are handed out in commit order. The deltas may be SQL expressions.
+        """
+        values = {'tasks_version': cls.tasks_version + 1}
+        if not isinstance(total_delta, int) or total_delta:
+            values['tasks_total'] = cls.tasks_total + total_delta
+        if not isinstance(completed_delta, int) or completed_delta:
+            values['tasks_completed'] = cls.tasks_completed + completed_delta
+        statement = db.update(cls).where(cls.id == id).values(values)
+        if supports_returning():
+            return db.session.execute(statement.returning(cls.tasks_version)).scalar()
+        db.session.execute(statement)
+        return cls.get_tasks_version(id)
+
+    @classmethod
+    def select_tombstones_purged_seq(cls, id):
+        return db.select(cls.tombstones_purged_seq).where(cls.id == id)
+
+    @classmethod
+    def get_tombstones_purged_seq(cls, id):
+        return db.session.execute(cls.select_tombstones_purged_seq(id)).scalar()
+
+    @classmethod
+    def get_tasks_versions(cls, ids):
+        """
+        :return: dict of user id to tasks version, for the given users
+        """
+        return dict(db.session.query(cls.id, cls.tasks_version).filter(cls.id.in_(ids)).all()) if ids else {}
+
+    @classmethod
+    def select_task_counters(cls, id):
+        return db.select(cls.tasks_total, cls.tasks_completed).where(cls.id == id)
+
+    @classmethod
+    def get_task_counters(cls, id):
+        return db.session.execute(cls.select_task_counters(id)).first()
+
+    @classmethod
+    def rebuild_task_counters(cls):
+        """
+        Recomputes every user's task counters from the tasks table.
+        """
+        total = db.session.query(db.func.count(Task.id)).filter(Task.user_id == cls.id).scalar_subquery()
+        completed = db.session.query(db.func.count(Task.id)) \
+            .filter(Task.user_id == cls.id, Task.is_completed.is_(True)).scalar_subquery()
+        cls.query.update({'tasks_total': total, 'tasks_completed': completed}, synchronize_session=False)
+        db.session.commit()
+
+    @classmethod
+    def update_password(cls, id, password):
+        cls.query.filter_by(id=id).update({'password': password})
+        db.session.commit()
+
     @staticmethod
     def generate_hash(password):
-        return sha256.hash(password)
+        with timed('password_hash_duration', operation='hash'):
+            return current_app.extensions['password_hasher'].hash(password)
 
     @staticmethod
     def verify_hash(password, hash):
-        return sha256.verify(password, hash)
+        with timed('password_hash_duration', operation='verify'):
+            return current_app.extensions['password_hasher'].verify(password, hash)
+
+    @staticmethod
+    def hash_needs_update(hash):
+        return current_app.extensions['password_hasher'].needs_update(hash)
 
 class Task(db.Model):
     __tablename__ = "tasks"
+    __table_args__ = (
+        # (user_id, id) serves the unfiltered keyset listing, (user_id, is_completed, id)
+        # the listing filtered on completion status.
+        db.Index('ix_tasks_user_id_id', 'user_id', 'id'),
+        db.Index('ix_tasks_user_id_is_completed_id', 'user_id', 'is_completed', 'id'),
+        db.Index('ix_tasks_user_id_change_seq', 'user_id', 'change_seq'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     heading = db.Column(db.String(360))
     description = db.Column(db.Text)
     is_completed = db.Column(db.Boolean, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # The owner's tasks version at this task's last write
+    change_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def save(self):
+        self.change_seq = User.next_tasks_version(self.user_id, total_delta=1,
+                                                  completed_delta=int(bool(self.is_completed)))
         db.session.add(self)
         db.session.commit()
 
+    FIELDS = ('id', 'heading', 'description', 'is_completed', 'version')
+
+    def to_dict(self, fields=FIELDS):
+        """
+        Serializes the given fields only, so columns deferred with load_only are never loaded.
+        """
+        task_dict = {field: getattr(self, field) for field in fields}
+        if 'is_completed' in task_dict:
+            task_dict['is_completed'] = str(task_dict['is_completed'])
+        return task_dict
+
+    @classmethod
+    def _load_only(cls, fields):
+        return orm.load_only(*[getattr(cls, field) for field in fields])
+
     @classmethod
     def get_task_by_id(cls, id):
         return cls.query.filter_by(id=id).first()
 
+    @staticmethod
+    def _get_cache():
+        return current_app.extensions['task_cache']
+
     @classmethod
-    def update_task(cls, id, heading, description, is_completed):
-        task = cls.query.filter_by(id=id).first()
-        task.heading = heading
-        task.description = description
-        task.is_completed = is_completed
-        db.session.commit()
+    def select_task(cls, id, user_id, fields=None):
+        """
+        Selects the task with the given id if user_id owns it, loading only fields if given
+        """
+        statement = db.select(cls).where(cls.id == id, cls.user_id == user_id)
+        return statement if fields is None else statement.options(cls._load_only(fields))
 
     @classmethod
-    def delete_task(cls, id):
-        task = cls.query.filter_by(id=id).first()
-        db.session.delete(task)
-        db.session.commit()
+    def get_task_dict_by_id(cls, id, user_id, fields=None):
+        """
+        Read-through lookup of a task owned by user_id, served from the task cache when enabled.
+        Cached tasks carry their "user_id", so a cache hit is checked against the owner too.
+        With fields, a cache miss loads only those columns plus id and version, and the
+        partial task is not cached.
+        :return: task dict with at least fields, id and version, or None if the user has no such task
+        """
+        cache = cls._get_cache()
+        if cache is not None:
+            task_dict = cache.get(id)
+            if task_dict is not None and 'user_id' in task_dict:
+                return task_dict if task_dict['user_id'] == user_id else None
+        if fields is not None:
+            fields = tuple(set(fields) | {'id', 'version'})
+            task = db.session.execute(cls.select_task(id, user_id, fields)).scalars().first()
+            return None if task is None else task.to_dict(fields)
+        task = db.session.execute(cls.select_task(id, user_id)).scalars().first()
+        if task is None:
+            return None
+        task_dict = dict(task.to_dict(), user_id=task.user_id)
+        if not is_reading_from_replica():
+            # a lagging replica may return the row a write just invalidated
+            cls._fill_cache(id, task_dict)
+        return task_dict
+
+    @classmethod
+    def _fill_cache(cls, id, task_dict):
+        """
+        Caches a task read from the database, unless the key holds a task or an invalidation
+        marker. The add is atomic, so a read that loaded the row before a write committed
+        cannot store it over the marker the write left.
+        """
+        cache = cls._get_cache()
+        if cache is not None:
+            cache.add(id, task_dict)
+
+    @classmethod
+    def invalidate_cache(cls, ids):
+        """
+        Replaces the cached tasks with an invalidation marker, which blocks fills for
+        TASK_CACHE_INVALIDATION_TTL seconds, rather than deleting them
+        """
+        cache = cls._get_cache()
+        if cache is not None:
+            ttl = current_app.config['TASK_CACHE_INVALIDATION_TTL']
+            for id in ids:
+                cache.set(id, {'invalidated': True}, ttl=ttl)
+
+    @classmethod
+    def select_tasks_page(cls, user_id, limit, cursor=None, is_completed=None, min_id=None, max_id=None,
+                          fields=None):
+        """
+        Selects one page of the user's tasks ordered by id, keyset-paginated on Task.id.
+        All the filters are applied as WHERE clauses. One extra row is selected to know
+        whether another page exists, see split_page. With fields, only those columns (and id)
+        are loaded.
+        """
+        statement = db.select(cls).where(cls.user_id == user_id)
+        if fields is not None:
+            statement = statement.options(cls._load_only(fields))
+        if cursor is not None:
+            statement = statement.where(cls.id > cursor)
+        if is_completed is not None:
+            statement = statement.where(cls.is_completed == is_completed)
+        if min_id is not None:
+            statement = statement.where(cls.id >= min_id)
+        if max_id is not None:
+            statement = statement.where(cls.id <= max_id)
+        return statement.order_by(cls.id).limit(limit + 1)
+
+    @staticmethod
+    def split_page(tasks, limit):
+        """
+        :return: the first limit of the tasks read by select_tasks_page, next cursor (None if
+        this is the last page)
+        """
+        if len(tasks) > limit:
+            tasks = tasks[:limit]
+            return tasks, tasks[-1].id
+        return tasks, None
+
+    @classmethod
+    def list_tasks(cls, user_id, limit, cursor=None, is_completed=None, min_id=None, max_id=None, fields=None):
+        """
+        Returns one page of the user's tasks ordered by id, see select_tasks_page.
+        :return: list of tasks, next cursor (None if this is the last page)
+        """
+        statement = cls.select_tasks_page(user_id, limit, cursor=cursor, is_completed=is_completed,
+                                          min_id=min_id, max_id=max_id, fields=fields)
+        return cls.split_page(db.session.execute(statement).scalars().all(), limit)
+
+    @classmethod
+    def iter_tasks(cls, user_id, chunk_size):
+        """
+        Iterates over all the user's tasks ordered by id, fetching chunk_size rows at a time
+        through a server side cursor where the backend supports one.
+        """
+        return cls.query.filter(cls.user_id == user_id).order_by(cls.id) \
+            .execution_options(stream_results=True).yield_per(chunk_size)
+
+    @classmethod
+    def get_owned_ids(cls, user_id, ids):
+        if not ids:
+            return set()
+        rows = db.session.query(cls.id).filter(cls.user_id == user_id, cls.id.in_(ids)).all()
+        return {row.id for row in rows}
+
+    @classmethod
+    def batch_write(cls, user_id, creates, updates, deletes):
+        """
+        Applies many writes for one user in a single transaction with bulk statements.
+        :param creates: list of task column dicts, each gets its new "id" set in place
+        :param updates: list of task column dicts, each including the "id" to update
+        :param deletes: list of task ids to delete
+        """
+        try:
+            cls.apply_batch(user_id, creates, updates, deletes)
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+        cls.invalidate_cache([task_data['id'] for task_data in updates] + deletes)
+        if deletes:
+            TaskTombstone.purge_if_due()
+
+    @classmethod
+    def apply_batch(cls, user_id, creates, updates, deletes):
+        """
+        Issues the statements of batch_write in the current transaction, without committing.
+        Does nothing, and leaves the tasks version alone, when there are no writes.
+        """
+        if not (creates or updates or deletes):
+            return
+        changed_ids = [task_data['id'] for task_data in updates if 'is_completed' in task_data] + deletes
+        was_completed = dict(db.session.query(cls.id, cls.is_completed).filter(
+            cls.user_id == user_id, cls.id.in_(changed_ids)).with_for_update().all()) if changed_ids else {}
+        # tasks deleted concurrently since the caller checked ownership are neither counted nor tombstoned
+        deletes = [id for id in deletes if id in was_completed]
+        if not (creates or updates or deletes):
+            return
+        completed_delta = sum(int(task_data['is_completed']) - int(was_completed[task_data['id']])
+                              for task_data in updates
+                              if 'is_completed' in task_data and task_data['id'] in was_completed)
+        completed_delta -= sum(int(was_completed[id]) for id in deletes)
+        completed_delta += sum(int(task_data['is_completed']) for task_data in creates)
+        change_seq = User.next_tasks_version(user_id, total_delta=len(creates) - len(deletes),
+                                             completed_delta=completed_delta)
+        if creates:
+            for task_data in creates:
+                task_data['user_id'] = user_id
+                task_data['change_seq'] = change_seq
+            db.session.bulk_insert_mappings(cls, creates, return_defaults=True)
+        if updates:
+            cls._bulk_update(updates, change_seq)
+        if deletes:
+            cls.query.filter(cls.user_id == user_id, cls.id.in_(deletes)).delete(synchronize_session=False)
+            db.session.bulk_insert_mappings(TaskTombstone, [
+                {'task_id': id, 'user_id': user_id, 'change_seq': change_seq} for id in deletes
+            ])
+
+    @classmethod
+    def bulk_create(cls, user_id, tasks):
+        """
+        Inserts the task column dicts with one executemany INSERT and commits.
+        """
+        try:
+            change_seq = User.next_tasks_version(
+                user_id,
+                total_delta=len(tasks),
+                completed_delta=sum(int(task_data.get('is_completed', False)) for task_data in tasks)
+            )
+            for task_data in tasks:
+                task_data['user_id'] = user_id
+                task_data['change_seq'] = change_seq
+            db.session.execute(cls.__table__.insert(), tasks)
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+
+    @classmethod
+    def _bulk_update(cls, updates, change_seq):
+        """
+        Issues one executemany UPDATE per distinct set of updated columns, bumping each task's version.
+        """
+        groups = {}
+        for task_data in updates:
+            columns = tuple(sorted(column for column in task_data if column != 'id'))
+            groups.setdefault(columns, []).append(task_data)
+        for columns, group in groups.items():
+            statement = cls.__table__.update().where(cls.id == db.bindparam('_id')).values(
+                version=cls.version + 1, change_seq=change_seq, **{column: db.bindparam('_' + column) for column in columns})
+            db.session.execute(statement, [
+                dict({'_' + column: task_data[column] for column in columns}, _id=task_data['id'])
+                for task_data in group
+            ])
+
+    @classmethod
+    def _lock_task(cls, id, user_id):
+        """
+        Locks the task owned by user_id with SELECT ... FOR UPDATE, so a concurrent write of the
+        same task waits for this transaction, and the completed delta the counters get is computed
+        from the committed row. SQLite has no row locks, but serializes write transactions.
+        :return: False if the user has no such task
+        """
+        return db.session.execute(
+            db.select(cls.id).where(cls.id == id, cls.user_id == user_id).with_for_update()
+        ).first() is not None
+
+    @classmethod
+    def _completed_delta(cls, id, user_id, is_completed):
+        """
+        SQL expression for the change in the owner's completed counter when the task's
+        is_completed becomes the given value (False for a deletion), evaluated by the statement
+        that applies it. Call it with the task locked.
+        """
+        was_completed = db.select(cls.is_completed).where(cls.id == id, cls.user_id == user_id).scalar_subquery()
+        return db.case((was_completed, 0), else_=1) if is_completed else db.case((was_completed, -1), else_=0)
+
+    @classmethod
+    def update_task(cls, id, user_id, heading=None, description=None, is_completed=None):
+        """
+        Updates the given columns of a task owned by user_id with an owner scoped UPDATE, after
+        locking the task row, without loading the task. Columns passed as None are left unchanged.
+        :return: the updated task row (RETURNING where the backend supports it), or None if the
+            user has no such task
+        """
+        values = {'version': cls.version + 1}
+        if heading is not None:
+            values['heading'] = heading
+        if description is not None:
+            values['description'] = description
+        if is_completed is not None:
+            values['is_completed'] = is_completed
+        try:
+            if not cls._lock_task(id, user_id):
+                db.session.rollback()
+                return None
+            values['change_seq'] = User.next_tasks_version(
+                user_id,
+                completed_delta=0 if is_completed is None else cls._completed_delta(id, user_id, is_completed)
+            )
+            statement = db.update(cls).where(cls.id == id, cls.user_id == user_id).values(values)
+            columns = [getattr(cls, field) for field in cls.FIELDS]
+            if supports_returning():
+                task = db.session.execute(statement.returning(*columns)).first()
+            elif db.session.execute(statement).rowcount:
+                task = db.session.execute(db.select(*columns).where(cls.id == id)).first()
+            else:
+                task = None
+            if not task:
+                db.session.rollback()
+                return None
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+        cls.invalidate_cache([id])
+        return task
+
+    @classmethod
+    def delete_task(cls, id, user_id):
+        """
+        Deletes a task owned by user_id with an owner scoped DELETE, after locking the task row,
+        and records its tombstone.
+        :return: False if the user has no such task
+        """
+        try:
+            if not cls._lock_task(id, user_id):
+                db.session.rollback()
+                return False
+            change_seq = User.next_tasks_version(user_id, total_delta=-1,
+                                                 completed_delta=cls._completed_delta(id, user_id, False))
+            if not db.session.execute(db.delete(cls).where(cls.id == id, cls.user_id == user_id)).rowcount:
+                db.session.rollback()
+                return False
+            db.session.add(TaskTombstone(task_id=id, user_id=user_id, change_seq=change_seq))
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+        cls.invalidate_cache([id])
+        TaskTombstone.purge_if_due()
+        return True
+
+    @classmethod
+    def select_changes(cls, user_id, since, until):
+        """
+        Selects the user's tasks written and tombstones (task_id, change_seq) recorded after change
+        sequence number since, up to and including until, ordered by change_seq.
+        :return: tasks statement, tombstones statement
+        """
+        tasks = db.select(cls).where(cls.user_id == user_id, cls.change_seq > since, cls.change_seq <= until) \
+            .order_by(cls.change_seq, cls.id)
+        tombstones = db.select(TaskTombstone.task_id, TaskTombstone.change_seq).where(
+            TaskTombstone.user_id == user_id,
+            TaskTombstone.change_seq > since,
+            TaskTombstone.change_seq <= until
+        ).order_by(TaskTombstone.change_seq, TaskTombstone.id)
+        return tasks, tombstones
+
+    @staticmethod
+    def _all(statement):
+        return db.session.execute(statement).scalars().all()
+
+    @classmethod
+    def _get_change_rows(cls, user_id, since, until, limit=None, with_tombstones=True):
+        """
+        Returns the user's tasks written and tombstones (task_id, change_seq) recorded after change
+        sequence number since, up to and including the returned cursor, ordered by change_seq.
+        Without limit the cursor is until. With limit, the cursor stops once about limit changes
+        are read; the writes of one change sequence number (e.g. a batch) are never split.
+        :return: tasks, tombstones, cursor
+        """
+        tasks, tombstones = cls.select_changes(user_id, since, until)
+        if limit is None:
+            return cls._all(tasks), db.session.execute(tombstones).all() if with_tombstones else [], until
+        page_tasks = cls._all(tasks.limit(limit + 1))
+        page_tombstones = db.session.execute(tombstones.limit(limit + 1)).all() if with_tombstones else []
+        seqs = sorted([task.change_seq for task in page_tasks] + [row.change_seq for row in page_tombstones])
+        if len(seqs) <= limit:
+            return page_tasks, page_tombstones, until
+        # Everything before the first change left out fits the page
+        cursor = seqs[limit] - 1
+        if cursor < seqs[0]:
+            # one write of more than limit tasks; send it whole
+            cursor = seqs[0]
+            return (cls._all(tasks.where(cls.change_seq <= cursor)),
+                    db.session.execute(tombstones.where(TaskTombstone.change_seq <= cursor)).all(), cursor)
+        return ([task for task in page_tasks if task.change_seq <= cursor],
+                [row for row in page_tombstones if row.change_seq <= cursor], cursor)
+
+    @classmethod
+    def get_changes(cls, user_id, since, until, limit=None):
+        """
+        Returns the user's tasks written and the ids of tasks deleted after change sequence
+        number since, up to and including the returned cursor, which is until unless limit cut
+        the page short. With since None, returns the user's tasks and no deletions.
+        :return: tasks, deleted ids, cursor
+        """
+        tasks, tombstones, cursor = cls._get_change_rows(user_id, since or 0, until, limit,
+                                                         with_tombstones=since is not None)
+        return tasks, [row.task_id for row in tombstones], cursor
+
+    @classmethod
+    def get_change_log(cls, user_id, since, until):
+        """
+        Returns the user's task writes after change sequence number since, up to and including
+        until, as (change_seq, op, data) ordered by change_seq. op is "create" for a task written
+        once, "update" for one written again, and "delete" with data {"id"} for a deleted task.
+        """
+        tasks, tombstones, _ = cls._get_change_rows(user_id, since, until)
+        return cls.to_change_log(tasks, tombstones)
+
+    @staticmethod
+    def to_change_log(tasks, tombstones):
+        """
+        :return: the changes of the tasks and tombstones read by select_changes, as returned by
+        get_change_log
+        """
+        events = [(task.change_seq, 'create' if task.version == 1 else 'update', task.to_dict()) for task in tasks]
+        events.extend((row.change_seq, 'delete', {'id': row.task_id}) for row in tombstones)
+        events.sort(key=lambda event: event[0])
+        return events
+
+    @classmethod
+    def search(cls, user_id, q, limit, offset=0):
+        """
+        Returns the user's tasks whose heading or description contain all the words of q, best
+        matches first. SQLite ranks with bm25 over the FTS5 index; other backends rank tasks
+        with more of the words in their heading first.
+        """
+        words = q.split()
+        query = cls.query.filter(cls.user_id == user_id)
+        if db.engine.dialect.name == 'sqlite':
+            fts = db.table(FTS_TABLE, db.column('rowid'))
+            query = query.join(fts, fts.c.rowid == cls.id) \
+                .filter(db.text('%s MATCH :match' % FTS_TABLE)).params(match=to_match_query(q)) \
+                .order_by(db.text('bm25(%s)' % FTS_TABLE), cls.id)
+        else:
+            patterns = ['%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                        for word in words]
+            for pattern in patterns:
+                query = query.filter(db.or_(cls.heading.ilike(pattern, escape='\\'),
+                                            cls.description.ilike(pattern, escape='\\')))
+            heading_matches = sum(db.case([(cls.heading.ilike(pattern, escape='\\'), 1)], else_=0)
+                                  for pattern in patterns)
+            query = query.order_by(heading_matches.desc(), cls.id)
+        return query.limit(limit).offset(offset).all()
+
+
+register_search_index(Task.__table__)
+
+
+class TaskTombstone(db.Model):
+    """
+    Records a deleted task so delta sync clients learn about the deletion
+    """
+    __tablename__ = 'task_tombstones'
+    __table_args__ = (
+        db.Index('ix_task_tombstones_user_id_change_seq', 'user_id', 'change_seq'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    change_seq = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.utcnow,
+                           server_default=db.func.current_timestamp())
+
+    _last_purge = 0
+
+    @classmethod
+    def purge_if_due(cls):
+        """
+        Purges expired tombstones at most every TASK_TOMBSTONE_PURGE_INTERVAL seconds per process
+        """
+        if time.monotonic() - cls._last_purge > current_app.config['TASK_TOMBSTONE_PURGE_INTERVAL']:
+            cls.purge_expired()
+
+    @classmethod
+    def purge_expired(cls):
+        """
+        Deletes the tombstones older than TASK_TOMBSTONE_RETENTION seconds, first recording on
+        each user the highest change sequence number purged, so delta sync from an older cursor
+        can be told to resync instead of silently missing those deletions.
+        :return: number of tombstones deleted
+        """
+        cls._last_purge = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['TASK_TOMBSTONE_RETENTION'])
+        expired = db.and_(cls.user_id == User.id, cls.deleted_at < cutoff)
+        try:
+            db.session.execute(db.update(User).where(db.exists().where(expired)).values(
+                tombstones_purged_seq=db.select(db.func.max(cls.change_seq)).where(expired).scalar_subquery()
+            ).execution_options(synchronize_session=False))
+            deleted = cls.query.filter(cls.deleted_at < cutoff).delete(synchronize_session=False)
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+        return deleted
 
 
 class RevokedTokens(db.Model):
     __tablename__ = 'revoked_tokens'
     id = db.Column(db.Integer, primary_key=True)
-    token = db.Column(db.String(120))
+    jti = db.Column(db.String(120), unique=True, index=True, nullable=False)
+    expires_at = db.Column(db.DateTime, index=True)
+
+    _last_purge = 0
 
     def save(self):
         db.session.add(self)
         db.session.commit()
 
+    @staticmethod
+    def _get_cache():
+        return current_app.extensions['revoked_tokens_cache']
+
+    @classmethod
+    def revoke(cls, jti, exp=None):
+        """
+        Revokes the token with the given jti until its expiry time (unix timestamp).
+        Expired revocations are purged every REVOKED_TOKENS_PURGE_INTERVAL seconds.
+        """
+        expires_at = None if exp is None else datetime.utcfromtimestamp(exp)
+        cls(jti=jti, expires_at=expires_at).save()
+        ttl = None if exp is None else max(exp - time.time(), 0)
+        cls._get_cache().set(jti, True, ttl=ttl)
+        if time.monotonic() - cls._last_purge > current_app.config['REVOKED_TOKENS_PURGE_INTERVAL']:
+            cls.purge_expired()
+
+    @classmethod
+    def purge_expired(cls):
+        cls.query.filter(cls.expires_at < datetime.utcnow()).delete(synchronize_session=False)
+        db.session.commit()
+        cls._last_purge = time.monotonic()
+
+    @classmethod
+    def is_token_revoked(cls, jti):
+        cache = cls._get_cache()
+        revoked = cache.get(jti)
+        if revoked is not None:
+            return revoked
+        revoked = db.session.execute(cls.select_revoked(jti)).scalar()
+        cls.cache_revoked(jti, revoked)
+        return revoked
+
+    @classmethod
+    def select_revoked(cls, jti):
+        return db.select(db.exists().where(cls.jti == jti))
+
     @classmethod
-    def is_token_revoked(cls, token):
-        query = cls.query.filter_by(token=token).first()
-        return bool(query)
+    def cache_revoked(cls, jti, revoked):
+        """
+        Caches the revocation state read from the database. Revoked tokens stay revoked, while
+        tokens found valid are checked again after REVOKED_TOKENS_NEGATIVE_TTL seconds.
+        """
+        ttl = None if revoked else current_app.config['REVOKED_TOKENS_NEGATIVE_TTL']
+        cls._get_cache().set(jti, revoked, ttl=ttl)
@@ -0,0 +1,55 @@
+from sqlalchemy import DDL, event
+
+FTS_TABLE = 'tasks_fts'
+
+# External content FTS5 index over tasks(heading, description), kept in sync by triggers so
+# every write path, including bulk INSERT/UPDATE/DELETE statements, maintains it.
+CREATE_FTS_STATEMENTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5("
+    "heading, description, content='tasks', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_ai AFTER INSERT ON tasks BEGIN "
+    "INSERT INTO tasks_fts(rowid, heading, description) VALUES (new.id, new.heading, new.description); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_ad AFTER DELETE ON tasks BEGIN "
+    "INSERT INTO tasks_fts(tasks_fts, rowid, heading, description) "
+    "VALUES ('delete', old.id, old.heading, old.description); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_au AFTER UPDATE OF heading, description ON tasks BEGIN "
+    "INSERT INTO tasks_fts(tasks_fts, rowid, heading, description) "
+    "VALUES ('delete', old.id, old.heading, old.description); "
+    "INSERT INTO tasks_fts(rowid, heading, description) VALUES (new.id, new.heading, new.description); "
+    "END",
+)
+REBUILD_FTS_STATEMENT = "INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')"
+DROP_FTS_STATEMENTS = (
+    "DROP TRIGGER IF EXISTS tasks_fts_au",
+    "DROP TRIGGER IF EXISTS tasks_fts_ad",
+    "DROP TRIGGER IF EXISTS tasks_fts_ai",
+    "DROP TABLE IF EXISTS tasks_fts",
+)
+
+
+def register_search_index(table):
+    """
+    Creates and drops the SQLite search index along with table in create_all/drop_all.
+    Other backends search without an index.
+    """
+    for statement in CREATE_FTS_STATEMENTS:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    for statement in DROP_FTS_STATEMENTS:
+        event.listen(table, 'before_drop', DDL(statement).execute_if(dialect='sqlite'))
+
+
+def is_search_index_name(name):
+    """
+    Tells migrations which tables belong to the search index rather than to the models.
+    """
+    return name is not None and name.startswith(FTS_TABLE)
+
+
+def to_match_query(q):
+    """
+    Turns free text into an FTS5 query matching all its words, so user input cannot
+    inject FTS5 syntax.
+    """
+    return ' '.join('"%s"' % word.replace('"', '""') for word in q.split())
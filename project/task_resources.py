@@ -1,35 +1,80 @@
 from flask_restful import Resource, abort
-from flask import jsonify
+from flask import current_app, request, Response, stream_with_context
 from project.parsers import Parser
 from project.schema import User, Task
-import sqlalchemy
-from flask_jwt_extended import (jwt_required, get_jwt_identity)
+from project.tokens import Tokens, jwt_required
+from project.importer import TaskImporter
+from project.idempotency import idempotent
+from project.events import format_event
+import hashlib
+import json
+from werkzeug.http import quote_etag
+
+
+def publish_changes(user_id):
+    """
+    Pushes the user's task writes to their open event streams in this process without waiting
+    for the next poll
+    """
+    current_app.extensions['task_events'].notify(user_id)
+
+
+def get_task_etag(task, fields=None):
+    """
+    ETag of a task dict, or of the given fields of it
+    """
+    etag = '%s-%s' % (task['id'], task['version'])
+    if fields is not None:
+        etag += '-' + ','.join(fields)
+    return etag
+
+
+def list_tasks_etag(user_id, tasks_version, query_string):
+    """
+    ETag of a page of the user's tasks, which changes with every write to them
+    """
+    return '%s-%s-%s' % (user_id, tasks_version, hashlib.md5(query_string).hexdigest())
+
+
+def not_modified(etag):
+    """
+    Returns a 304 response if the request's If-None-Match matches etag, else None
+    """
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': quote_etag(etag)})
+    return None
 
 
 class CreateTask(Resource):
     """
     Given a request with params {"heading", "description"}
+    With TASK_WRITE_COALESCING the write is committed together with concurrent creates and updates
+    Retries carrying the same Idempotency-Key header get the first response back
     Endpoint is jwt protected
     """
 
     @jwt_required
+    @idempotent
     def post(self):
-        task_parser = Parser.get_tasks_parser(id_req=False, heading_req=True, desc_req=True)
-        task_data = task_parser.parse_args()
-        username = get_jwt_identity()
-        user = User.get_user_by_name(username=username)
-
-        task = Task(
-            user_id=user.id,
-            heading=task_data['heading'],
-            description=task_data['description'],
-            is_completed=False
-        )
+        task_data = Parser.create_task.parse_args()
+        writer = current_app.extensions['task_writer']
+
         try:
-            task.save()
+            if writer is not None:
+                task_id = writer.create(Tokens.get_user_id(), task_data['heading'], task_data['description'])
+            else:
+                task = Task(
+                    user_id=Tokens.get_user_id(),
+                    heading=task_data['heading'],
+                    description=task_data['description'],
+                    is_completed=False
+                )
+                task.save()
+                task_id = task.id
+            publish_changes(Tokens.get_user_id())
             return {
                 'message': 'Task was created successfully',
-                'id': task.id
+                'id': task_id
             }
         except:
             abort(500, description="Failed to create task")
@@ -38,21 +83,22 @@ class CreateTask(Resource):
 class GetTask(Resource):
     """
     Retrieve a task given "id" of task in params
+    Query param "fields" may restrict the response to a comma separated subset of
+    {"id", "heading", "description", "is_completed", "version"}
+    Responds 409 unless the task belongs to the user logged in
     Endpoint is jwt protected
     """
 
     @jwt_required
     def get(self, id):
+        fields = Parser.get_task.parse_args()['fields']
         try:
-            task = Task.get_task_by_id(id)
+            task = Task.get_task_dict_by_id(id, Tokens.get_user_id(), fields)
             if task == None:
                 raise KeyError
-            return {
-                'id': task.id,
-                'heading': task.heading,
-                'description': task.description,
-                'is_completed': str(task.is_completed)
-            }
+            etag = get_task_etag(task, fields)
+            task = {field: task[field] for field in fields or Task.FIELDS}
+            return not_modified(etag) or (task, 200, {'ETag': quote_etag(etag)})
         except KeyError:
             abort(409, description='Task %d does not exist' % id)
         except:
@@ -61,72 +107,318 @@ class GetTask(Resource):
 
 class ListTasks(Resource):
     """
-    Lists all the tasks for the user logged in.
+    Lists the tasks for the user logged in, one page at a time.
+    Query params may include any of {"cursor", "limit", "is_completed", "min_id", "max_id", "fields"}
+    The ETag is derived from the user's tasks version, so a matching If-None-Match
+    is answered with 304 without loading any task.
+    Endpoint is jwt protected
+    """
+
+    @jwt_required
+    def get(self):
+        list_data = Parser.list_tasks.parse_args()
+        user_id = Tokens.get_user_id()
+        etag = list_tasks_etag(user_id, User.get_tasks_version(user_id), request.query_string)
+        response = not_modified(etag)
+        if response:
+            return response
+        limit = min(list_data['limit'] or current_app.config['TASKS_PAGE_SIZE_DEFAULT'],
+                    current_app.config['TASKS_PAGE_SIZE_MAX'])
+        tasks, next_cursor = Task.list_tasks(
+            user_id=user_id,
+            limit=limit,
+            cursor=list_data['cursor'],
+            is_completed=list_data['is_completed'],
+            min_id=list_data['min_id'],
+            max_id=list_data['max_id'],
+            fields=list_data['fields']
+        )
+        fields = list_data['fields'] or Task.FIELDS
+        return {
+            'tasks': [task.to_dict(fields) for task in tasks],
+            'next_cursor': next_cursor
+        }, 200, {'ETag': quote_etag(etag)}
+
+
+class SearchTasks(Resource):
+    """
+    Full text search over the heading and description of the tasks of the user logged in.
+    Query params: "q" (required), "limit" and "offset". Results are ranked best match first.
+    Endpoint is jwt protected
+    """
+
+    @jwt_required
+    def get(self):
+        search_data = Parser.search_tasks.parse_args()
+        limit = min(search_data['limit'] or current_app.config['TASKS_PAGE_SIZE_DEFAULT'],
+                    current_app.config['TASKS_PAGE_SIZE_MAX'])
+        tasks = Task.search(Tokens.get_user_id(), search_data['q'], limit=limit + 1, offset=search_data['offset'])
+        return {
+            'tasks': [task.to_dict() for task in tasks[:limit]],
+            'next_offset': search_data['offset'] + limit if len(tasks) > limit else None
+        }
+
+
+class TaskSummary(Resource):
+    """
+    Returns the total, completed and pending task counts of the user logged in,
+    read from the user's precomputed counters.
+    Endpoint is jwt protected
+    """
+
+    @jwt_required
+    def get(self):
+        counters = User.get_task_counters(Tokens.get_user_id())
+        return {
+            'total': counters.tasks_total,
+            'completed': counters.tasks_completed,
+            'pending': counters.tasks_total - counters.tasks_completed
+        }
+
+
+class ListTaskChanges(Resource):
+    """
+    Delta sync: lists the tasks written and the ids of tasks deleted since the "cursor"
+    returned by a previous call, passed as the "since" query param. Without "since"
+    all the user's tasks are returned. Clients apply the deletions before the tasks.
+    At most about "limit" changes are returned per call; while "has_more" is true, call
+    again with the returned cursor. A cursor older than the deletions still kept gets 410,
+    and the client must resync without "since".
+    Endpoint is jwt protected
+    """
+
+    @jwt_required
+    def get(self):
+        changes_data = Parser.task_changes.parse_args()
+        user_id = Tokens.get_user_id()
+        since = changes_data['since']
+        if since is not None and since < User.get_tombstones_purged_seq(user_id):
+            abort(410, description="Changes since %d are no longer kept, resync without since" % since)
+        limit = min(changes_data['limit'] or current_app.config['TASKS_PAGE_SIZE_DEFAULT'],
+                    current_app.config['TASKS_PAGE_SIZE_MAX'])
+        until = User.get_tasks_version(user_id)
+        tasks, deleted_ids, cursor = Task.get_changes(user_id, since=since, until=until, limit=limit)
+        return {
+            'tasks': [task.to_dict() for task in tasks],
+            'deleted': deleted_ids,
+            'cursor': cursor,
+            'has_more': cursor < until
+        }
+
+
+class TaskEvents(Resource):
+    """
+    Server-Sent Events stream of the task writes of the user logged in, replacing polling of
+    /tasks/changes. Each event is named "create", "update" or "delete" and carries the task
+    (just {"id"} for a delete) as JSON; its id is the change cursor, so a client reconnecting
+    with a Last-Event-ID header first gets the writes it missed. A "reset" event means the
+    client fell too far behind, or reconnected with an expired id, and must resync with
+    /tasks/changes.
+    Events carry the state of each task when the stream was sent its changes, not every write:
+    writes to a task between two polls arrive as one event, so a task created and updated
+    arrives as an "update", and one created and deleted as just a "delete". Clients should
+    upsert on "create" and "update", and ignore a "delete" of a task they do not have.
+    Endpoint is jwt protected
+    """
+
+    @jwt_required
+    def get(self):
+        user_id = Tokens.get_user_id()
+        hub = current_app.extensions['task_events']
+        heartbeat = current_app.config['TASK_EVENTS_HEARTBEAT']
+        try:
+            last_event_id = int(request.headers.get('Last-Event-ID', ''))
+        except ValueError:
+            last_event_id = None
+        subscription = hub.subscribe(user_id)
+        try:
+            # the deletions after a cursor older than the retained tombstones are lost; resync
+            expired = last_event_id is not None and last_event_id < User.get_tombstones_purged_seq(user_id)
+            missed = []
+            if last_event_id is not None and not expired and last_event_id < subscription.cursor:
+                missed = Task.get_change_log(user_id, last_event_id, subscription.cursor)
+        except:
+            hub.unsubscribe(subscription)
+            raise
+
+        def generate():
+            for event in missed:
+                yield format_event(event)
+            while not expired and not subscription.overflowed:
+                events = subscription.wait(heartbeat)
+                for event in events:
+                    yield format_event(event)
+                if not events and not subscription.overflowed:
+                    yield ': keepalive\n\n'
+            yield 'event: reset\ndata: {}\n\n'
+
+        # Not wrapped in stream_with_context, so the request's database session is released
+        # when the stream starts instead of being held while it is open.
+        response = Response(generate(), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # The server closes the response even when the client left before the stream started,
+        # in which case a finally block in generate would never run.
+        response.call_on_close(lambda: hub.unsubscribe(subscription))
+        return response
+
+
+class ExportTasks(Resource):
+    """
+    Streams all the tasks of the user logged in as newline delimited JSON, one task per line.
+    Rows are read and sent in chunks, so memory use does not grow with the number of tasks.
     Endpoint is jwt protected
     """
 
     @jwt_required
     def get(self):
-        username = get_jwt_identity()
-        user = User.get_user_by_name(username=username)
-        tasks = user.tasks
-        list_of_tasks = []
-        for task in tasks:
-            list_of_tasks.append({
-                'id': task.id,
-                'heading': task.heading,
-                'description': task.description,
-                'is_completed': str(task.is_completed)
-            })
-        return jsonify(list_of_tasks)
+        tasks = Task.iter_tasks(Tokens.get_user_id(), current_app.config['TASKS_EXPORT_CHUNK_SIZE'])
+
+        def generate():
+            for task in tasks:
+                yield json.dumps(task.to_dict()) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+class ImportTasks(Resource):
+    """
+    Imports tasks from an NDJSON or CSV upload, sent as the request body or as the "file"
+    field of a multipart form. The "format" query param (ndjson or csv) defaults to csv for
+    a text/csv body and to ndjson otherwise. Rows need "heading" and "description" and may
+    have "is_completed"; invalid rows are reported and do not stop the import.
+    Endpoint is jwt protected
+    """
+
+    @jwt_required
+    def post(self):
+        format = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+        if format not in TaskImporter.FORMATS:
+            abort(400, description="format must be one of %s" % ', '.join(TaskImporter.FORMATS))
+        upload = request.files['file'].stream if 'file' in request.files else request.stream
+
+        importer = TaskImporter(
+            user_id=Tokens.get_user_id(),
+            chunk_size=current_app.config['TASKS_IMPORT_CHUNK_SIZE'],
+            max_errors=current_app.config['TASKS_IMPORT_MAX_ERRORS']
+        )
+        try:
+            return importer.run(upload, format)
+        except:
+            abort(500, description="Import failed after %d tasks" % importer.imported)
+        finally:
+            publish_changes(importer.user_id)
 
 
 class UpdateTask(Resource):
     """
     Updates a given task. Params may include any of {"heading", "description", "is_completed"}
+    Responds 404 unless the task belongs to the user logged in
+    Retries carrying the same Idempotency-Key header get the first response back
     Endpoint is jwt protected
     """
 
     @jwt_required
+    @idempotent
     def post(self, id):
-        task_parser = Parser.get_tasks_parser(id_req=False)
-        task_data = task_parser.parse_args()
-        task = Task.get_task_by_id(id=id)
-        heading = task.heading if ('heading' not in task_data or task_data['heading'] == None) else task_data[
-            'heading']
-        description = task.description if ('description' not in task_data or task_data['description'] == None) else \
-        task_data['description']
-        is_completed = task.is_completed if (
-                    'is_completed' not in task_data or task_data['is_completed'] == None) else task_data[
-            'is_completed']
-
+        task_data = Parser.update_task.parse_args()
+        writer = current_app.extensions['task_writer']
         try:
-            Task.update_task(id=id, heading=heading, description=description, is_completed=bool(is_completed))
-            return {
-                'message': 'Task updated successfully',
-                'id': id,
-                'heading': heading,
-                'description': description,
-                'is_completed': is_completed
-            }
+            update_task = writer.update if writer is not None else Task.update_task
+            task = update_task(id=id, user_id=Tokens.get_user_id(), **task_data)
         except:
             abort(500, description="Failed to updated task %d" % id)
+        if task is None:
+            abort(404, description="Task %d does not exist" % id)
+        publish_changes(Tokens.get_user_id())
+        return {
+            'message': 'Task updated successfully',
+            'id': id,
+            'heading': task.heading,
+            'description': task.description,
+            'is_completed': str(task.is_completed)
+        }
 
 
 class DeleteTask(Resource):
     """
     Deletes a task given the task id
+    Responds 404 unless the task belongs to the user logged in
     Endpoint is jwt protected
     """
 
     @jwt_required
     def post(self, id):
         try:
-            Task.delete_task(id=id)
-            return {
-                'message': 'Task Deleted Successfully'
-            }
-        except sqlalchemy.orm.exc.UnmappedInstanceError:
-            abort(409, description="Task %d does not exist" % id)
+            deleted = Task.delete_task(id=id, user_id=Tokens.get_user_id())
         except:
             abort(500, description="Failed to delete task %d" % id)
+        if not deleted:
+            abort(404, description="Task %d does not exist" % id)
+        publish_changes(Tokens.get_user_id())
+        return {
+            'message': 'Task Deleted Successfully'
+        }
+
+
+class BatchTasks(Resource):
+    """
+    Applies a list of create/update/delete operations in one transaction.
+    Given a JSON body {"operations": [{"op": "create", "heading", "description"},
+    {"op": "update", "id", "heading", "description", "is_completed"}, {"op": "delete", "id"}]}
+    Operations take effect in the given order; an invalid operation or one on a task the user
+    does not own is reported in its result and does not stop the others.
+    Endpoint is jwt protected
+    """
+
+    @jwt_required
+    def post(self):
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(400, description="Request body must be a JSON object")
+        operations = body.get('operations')
+        if not isinstance(operations, list):
+            abort(400, description="operations must be a list")
+        if len(operations) > current_app.config['TASKS_BATCH_MAX_OPERATIONS']:
+            abort(400, description="At most %d operations are allowed per batch" %
+                  current_app.config['TASKS_BATCH_MAX_OPERATIONS'])
+
+        results = []
+        parsed = []
+        for operation in operations:
+            try:
+                parsed.append(Parser.parse_batch_operation(operation))
+                results.append(None)
+            except ValueError as e:
+                parsed.append(None)
+                results.append({'status': 400, 'message': str(e)})
+
+        user_id = Tokens.get_user_id()
+        existing_ids = Task.get_owned_ids(user_id, [item[1]['id'] for item in parsed
+                                                    if item is not None and item[0] != 'create'])
+        created, updates, deletes = [], {}, []
+        for index, item in enumerate(parsed):
+            if item is None:
+                continue
+            op, task_data = item
+            if op == 'create':
+                created.append((index, task_data))
+            elif task_data['id'] not in existing_ids:
+                results[index] = {'status': 404, 'op': op, 'message': 'Task %d does not exist' % task_data['id']}
+            elif op == 'update':
+                updates.setdefault(task_data['id'], {}).update(task_data)
+                results[index] = {'status': 200, 'op': op, 'id': task_data['id']}
+            else:
+                existing_ids.discard(task_data['id'])
+                updates.pop(task_data['id'], None)
+                deletes.append(task_data['id'])
+                results[index] = {'status': 200, 'op': op, 'id': task_data['id']}
+
+        if created or updates or deletes:
+            try:
+                Task.batch_write(user_id, [task_data for _, task_data in created], list(updates.values()), deletes)
+            except:
+                abort(500, description="Failed to apply batch")
+            publish_changes(user_id)
+        for index, task_data in created:
+            results[index] = {'status': 200, 'op': 'create', 'id': task_data['id']}
+        return {'results': results}
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import threading
+import unittest
+from flask import request
+from project.async_resources import AsyncResources
+from project.events import TaskEventHub
+from project.tests.base import BaseTestCase
+from project.tests.events_test import parse_event
+from project.tests.task_resources_test import TaskTestUtil
+
+
+class AsgiResponse:
+    def __init__(self, status_code, headers, data):
+        self.status_code = status_code
+        self.headers = headers
+        self.data = data
+
+    def get_json(self):
+        return json.loads(self.data.decode())
+
+
+class AsgiClient:
+    """
+    Calls an ASGI application in process, like a server would
+    """
+    def __init__(self, application):
+        self.application = application
+
+    def _scope(self, method, path, headers, query_string):
+        return {
+            'type': 'http', 'http_version': '1.1', 'scheme': 'http', 'root_path': '',
+            'method': method, 'path': path, 'query_string': query_string.encode(),
+            'headers': [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+            'server': ('localhost', 80)
+        }
+
+    async def request(self, method, path, headers=None, query_string='', body=b''):
+        if body:
+            headers = dict(headers or {}, **{'Content-Length': str(len(body))})
+        messages = []
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.application(self._scope(method, path, headers, query_string), receive, send)
+        return AsgiResponse(messages[0]['status'], {name.decode().lower(): value.decode()
+                                                     for name, value in messages[0]['headers']},
+                            b''.join(message.get('body', b'') for message in messages[1:]))
+
+    async def get(self, path, headers=None, query_string=''):
+        return await self.request('GET', path, headers, query_string)
+
+    async def stream(self, path, headers=None):
+        """
+        Opens a streamed GET request
+        :return: the response headers message, a queue of the body chunks and a function closing the stream
+        """
+        chunks = asyncio.Queue()
+        disconnected = asyncio.Event()
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            await chunks.put(message)
+
+        task = asyncio.ensure_future(self.application(self._scope('GET', path, headers, ''), receive, send))
+
+        async def close():
+            disconnected.set()
+            await asyncio.wait_for(task, 5)
+
+        return await asyncio.wait_for(chunks.get(), 5), chunks, close
+
+
+async def read_stream_events(chunks, count):
+    """
+    read_events over the body chunks of a stream opened with AsgiClient.stream
+    """
+    events = []
+    while len(events) < count:
+        event = parse_event((await asyncio.wait_for(chunks.get(), 5))['body'])
+        if event is not None:
+            events.append(event)
+    return events
+
+
+class TestAsyncResources(BaseTestCase):
+    """Tests for the asyncio serving mode"""
+
+    def setUp(self):
+        super().setUp()
+        self.fallbacks = []
+
+    def run_async(self, test):
+        """
+        Runs the coroutine function test with a client of a new AsyncResources, counting the
+        requests it hands to the Flask app in self.fallbacks
+        """
+        async def run():
+            resources = AsyncResources(self.app)
+            fallback = resources.fallback
+
+            async def counted_fallback(scope, receive, send):
+                self.fallbacks.append(scope['path'])
+                await fallback(scope, receive, send)
+            resources.fallback = counted_fallback
+            try:
+                return await test(AsgiClient(resources))
+            finally:
+                await resources.close()
+        return asyncio.run(run())
+
+    def test_reads(self):
+        """
+        Tests if task reads are answered without the Flask app, as the Flask app answers them
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        requests = [('/tasks/%d' % id1, ''), ('/tasks/%d' % id2, 'fields=heading,is_completed'),
+                    ('/tasks', ''), ('/tasks', 'limit=1&fields=id'), ('/tasks/summary', '')]
+
+        async def test(client):
+            return [await client.get(path, headers, query_string) for path, query_string in requests]
+        responses = self.run_async(test)
+        self.assertEqual(self.fallbacks, [])
+        for (path, query_string), response in zip(requests, responses):
+            expected = self.client.get(path, headers=headers, query_string=query_string)
+            self.assertEqual((response.status_code, response.get_json(), response.headers.get('etag')),
+                             (200, expected.get_json(), expected.headers.get('ETag')))
+
+    def test_not_modified(self):
+        """
+        Tests if a read whose ETag matches If-None-Match gets 304
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+
+        async def test(client):
+            responses = []
+            for path in ('/tasks/%d' % id1, '/tasks'):
+                etag = (await client.get(path, headers)).headers['etag']
+                responses.append(await client.get(path, dict(headers, **{'If-None-Match': etag})))
+            return responses
+        self.assertEqual([(response.status_code, response.data) for response in self.run_async(test)],
+                         [(304, b''), (304, b'')])
+
+    def test_errors_and_writes_use_flask(self):
+        """
+        Tests if failed reads and the other routes are answered by the Flask app
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        other_user = {'username': 'other', 'password': 'other462', 'email': 'other@gmail.com'}
+        self.client.post('/user/register', data=other_user)
+        other_token = self.client.post('/user/login', data=other_user).get_json()['access_token']
+        revoked_token = self.client.post('/user/login', data=TaskTestUtil.user_data).get_json()['access_token']
+        self.client.post('/user/access/logout', headers=dict(Authorization="Bearer " + revoked_token))
+
+        async def test(client):
+            return [
+                await client.get('/tasks'),
+                await client.get('/tasks/%d' % id1, dict(Authorization="Bearer " + other_token)),
+                await client.get('/tasks/%d' % id1, headers, 'fields=owner'),
+                await client.get('/tasks/summary', dict(Authorization="Bearer " + revoked_token)),
+                await client.request('POST', '/tasks/create', dict(headers, **{
+                    'Content-Type': 'application/x-www-form-urlencoded'}), body=b'heading=Task3&description=Third'),
+                await client.get('/tasks/summary', headers)
+            ]
+        responses = self.run_async(test)
+        self.assertEqual([response.status_code for response in responses], [401, 409, 400, 401, 200, 200])
+        self.assertEqual(self.fallbacks, ['/tasks', '/tasks/%d' % id1, '/tasks/%d' % id1, '/tasks/summary',
+                                          '/tasks/create'])
+        self.assertEqual(responses[3].get_json(), {'msg': 'Token has been revoked'})
+        self.assertEqual(responses[5].get_json()['total'], 3)
+
+    def test_flask_requests_run_concurrently(self):
+        """
+        Tests if the requests handed to the Flask app run on several threads at once
+        """
+        access_token = TaskTestUtil.get_access_token(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wait_for_each_other():
+            if request.path == '/tasks/search':
+                barrier.wait()
+        self.app.before_request_funcs.setdefault(None, []).append(wait_for_each_other)
+
+        async def test(client):
+            return await asyncio.gather(*[client.get('/tasks/search', headers, 'q=task') for _ in range(2)])
+        try:
+            responses = self.run_async(test)
+        finally:
+            self.app.before_request_funcs[None].remove(wait_for_each_other)
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+
+    def test_event_stream(self):
+        """
+        Tests if the event stream sends the missed and new writes, and unsubscribes when the client leaves
+        """
+        hub = TaskEventHub(self.app, poll_interval=0.05, queue_size=10)
+        previous_hub = self.app.extensions['task_events']
+        self.app.extensions['task_events'] = hub
+        self.app.config['TASK_EVENTS_HEARTBEAT'] = 0.1
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+
+        async def test(client):
+            start, chunks, close = await client.stream('/tasks/events', dict(headers, **{'Last-Event-ID': '0'}))
+            try:
+                events = await read_stream_events(chunks, 2)
+                # the write is made while the stream waits on the event loop
+                self.client.post('/tasks/%d/update' % id1, headers=headers, data={'is_completed': 'true'})
+                events += await read_stream_events(chunks, 1)
+            finally:
+                await close()
+            return start, events
+        try:
+            start, events = self.run_async(test)
+        finally:
+            self.app.extensions['task_events'] = previous_hub
+            self.app.config['TASK_EVENTS_HEARTBEAT'] = 15
+        self.assertEqual(self.fallbacks, [])
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream; charset=utf-8'), start['headers'])
+        self.assertEqual([(event, data['id']) for _, event, data in events],
+                         [('create', id1), ('create', id2), ('update', id1)])
+        self.assertEqual(hub._subscriptions, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
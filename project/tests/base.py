@@ -1,3 +1,5 @@
+import fnmatch
+import time
 from flask_testing import TestCase
 from run_tests import app, db
 
@@ -13,3 +15,33 @@ class BaseTestCase(TestCase):
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        for store in ('task_cache', 'idempotency_store'):
+            if app.extensions[store] is not None:
+                app.extensions[store].clear()
+
+
+class LocalRedis:
+    """
+    In-process stand-in for a redis client, implementing the commands the service uses.
+    """
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        value, expires_at = self.values.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and self.get(key) is not None:
+            return None
+        self.values[key] = (value.encode(), None if ex is None else time.monotonic() + ex)
+        return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def scan_iter(self, match='*'):
+        return [key for key in list(self.values) if fnmatch.fnmatch(key, match)]
@@ -0,0 +1,89 @@
+import threading
+import time
+from werkzeug.serving import make_server
+from project.benchmark import Benchmark, HttpClient, OPERATIONS, compare, percentile
+from project.events import TaskEventHub
+from project.tests.base import BaseTestCase
+
+
+class TestBenchmark(BaseTestCase):
+    """Tests for the benchmark suite"""
+
+    def test_percentile(self):
+        """
+        Tests if percentiles use the nearest rank
+        """
+        values = list(range(1, 101))
+        self.assertEqual((percentile(values, 50), percentile(values, 95), percentile(values, 99)), (50, 95, 99))
+        self.assertEqual(percentile([7], 99), 7)
+
+    def test_compare(self):
+        """
+        Tests if slower p95 latency and lower throughput beyond the tolerance are reported
+        """
+        baseline = {'get': {'p95_ms': 10.0, 'throughput': 100.0}, 'list': {'p95_ms': 10.0, 'throughput': 100.0}}
+        results = {'get': {'p95_ms': 11.0, 'throughput': 95.0}, 'list': {'p95_ms': 13.0, 'throughput': 70.0},
+                   'login': {'p95_ms': 50.0, 'throughput': 1.0}}
+        regressions = compare(results, baseline, tolerance=0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(all(regression.startswith('list:') for regression in regressions))
+
+    def test_run(self):
+        """
+        Tests if every operation is driven through the app without errors
+        """
+        bench = Benchmark(self.app, users=2, tasks_per_user=3, requests=4)
+        bench.seed()
+        results = bench.run()
+        self.assertEqual(tuple(results), OPERATIONS)
+        for operation, result in results.items():
+            self.assertEqual((operation, result['requests'], result['errors']), (operation, 4, 0))
+            self.assertTrue(result['p50_ms'] <= result['p95_ms'] <= result['p99_ms'])
+        self.assertGreater(results['create']['validation_us'], 0)
+        self.assertEqual(results['refresh']['validation_us'], 0)
+
+    def test_run_over_http(self):
+        """
+        Tests if the benchmark can drive a running server
+        """
+        server = make_server('127.0.0.1', 0, self.app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            client = HttpClient('http://127.0.0.1:%d/' % server.server_port)
+            bench = Benchmark(self.app, users=1, tasks_per_user=2, requests=2, client=client)
+            bench.seed()
+            results = bench.run()
+        finally:
+            server.shutdown()
+            thread.join()
+        self.assertEqual([result['errors'] for result in results.values()], [0] * len(OPERATIONS))
+
+    def test_run_concurrent(self):
+        """
+        Tests if concurrent clients can read tasks from a running server while streams are held open
+        """
+        hub = TaskEventHub(self.app, poll_interval=0.05, queue_size=10)
+        previous_hub = self.app.extensions['task_events']
+        self.app.extensions['task_events'] = hub
+        self.app.config['TASK_EVENTS_HEARTBEAT'] = 0.05
+        server = make_server('127.0.0.1', 0, self.app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            client = HttpClient('http://127.0.0.1:%d/' % server.server_port)
+            bench = Benchmark(self.app, users=2, tasks_per_user=2, requests=3, client=client)
+            bench.seed()
+            result = bench.run_concurrent(clients=4, streams=2)
+            # the streams end once their next keepalive finds the connection closed
+            for _ in range(100):
+                if not hub._subscriptions:
+                    break
+                time.sleep(0.05)
+        finally:
+            server.shutdown()
+            thread.join()
+            self.app.extensions['task_events'] = previous_hub
+            self.app.config['TASK_EVENTS_HEARTBEAT'] = 15
+        self.assertEqual((result['clients'], result['streams'], result['requests'], result['errors']), (4, 2, 12, 0))
+        self.assertEqual(hub._subscriptions, {})
@@ -0,0 +1,73 @@
+import time
+import unittest
+from flask import Flask
+from project.cache import TTLCache, RedisCache, require_shared_cache
+from project.tests.base import LocalRedis
+
+
+class TestCache(unittest.TestCase):
+    """Tests for the cache backends"""
+
+    def test_lru_eviction(self):
+        """
+        Tests if the least recently used entry is evicted once the cache is full
+        """
+        cache = TTLCache(2)
+        cache.set(1, 'one')
+        cache.set(2, 'two')
+        cache.get(1)
+        cache.set(3, 'three')
+        self.assertEqual(cache.get(1), 'one')
+        self.assertEqual(cache.get(2), None)
+        self.assertEqual(cache.get(3), 'three')
+
+    def test_ttl_expiry(self):
+        """
+        Tests if entries are dropped after their time to live
+        """
+        cache = TTLCache(10, ttl=0.01)
+        cache.set(1, 'one')
+        cache.set(2, 'two', ttl=60)
+        time.sleep(0.02)
+        self.assertEqual(cache.get(1), None)
+        self.assertEqual(cache.get(2), 'two')
+
+    def test_redis_cache(self):
+        """
+        Tests if the shared cache round trips JSON values under its prefix
+        """
+        client = LocalRedis()
+        cache = RedisCache(client, ttl=60, prefix='task:')
+        cache.set(1, {'id': 1, 'heading': 'Task1'})
+        self.assertEqual(list(client.values), ['task:1'])
+        self.assertEqual(cache.get(1), {'id': 1, 'heading': 'Task1'})
+        cache.delete(1)
+        self.assertEqual(cache.get(1), None)
+
+    def test_add(self):
+        """
+        Tests if add only sets absent or expired keys, with either backend
+        """
+        for cache in (TTLCache(10, ttl=0.01), RedisCache(LocalRedis(), ttl=0.01)):
+            self.assertTrue(cache.add(1, 'one'))
+            self.assertFalse(cache.add(1, 'uno'))
+            self.assertEqual(cache.get(1), 'one')
+            time.sleep(0.02)
+            self.assertTrue(cache.add(1, 'uno'))
+            self.assertEqual(cache.get(1), 'uno')
+
+    def test_require_shared_cache(self):
+        """
+        Tests if the per process backend is refused for a shared store with several worker processes
+        """
+        app = Flask(__name__)
+        app.config.update(WEB_CONCURRENCY=4, STORE_BACKEND='memory')
+        self.assertRaises(RuntimeError, require_shared_cache, app, 'STORE_BACKEND')
+        app.config['STORE_BACKEND'] = 'redis'
+        require_shared_cache(app, 'STORE_BACKEND')
+        app.config.update(WEB_CONCURRENCY=1, STORE_BACKEND='memory')
+        require_shared_cache(app, 'STORE_BACKEND')
+
+
+if __name__ == '__main__':
+    unittest.main()
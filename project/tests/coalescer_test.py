@@ -0,0 +1,86 @@
+import json
+import threading
+from sqlalchemy import event
+from project import db
+from project.coalescer import WriteCoalescer
+from project.schema import User, Task
+from project.tests.base import BaseTestCase
+from project.tests.task_resources_test import TaskTestUtil
+
+
+class TestWriteCoalescer(BaseTestCase):
+    """Tests for group commit of task writes"""
+
+    def setUp(self):
+        super().setUp()
+        self.writer = WriteCoalescer(self.app, max_batch=50, max_delay=0.05)
+        self.app.extensions['task_writer'] = self.writer
+
+    def tearDown(self):
+        self.app.extensions['task_writer'] = None
+        super().tearDown()
+
+    def _create_users(self, count):
+        users = [User(username='user%d' % i, email='user%d@gmail.com' % i, password='x') for i in range(count)]
+        for user in users:
+            user.save()
+        return [user.id for user in users]
+
+    def test_concurrent_writes_share_commits(self):
+        """
+        Tests if concurrent creates are committed together, each getting its own id
+        """
+        user_ids = self._create_users(2)
+        commits = []
+        listener = lambda connection: commits.append(1)
+        event.listen(db.engine, 'commit', listener)
+        ids = []
+        try:
+            threads = [threading.Thread(target=lambda i=i: ids.append(
+                self.writer.create(user_ids[i % 2], 'Task%d' % i, 'Description %d' % i))) for i in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            event.remove(db.engine, 'commit', listener)
+        self.assertEqual(len(set(ids)), 20)
+        self.assertLess(len(commits), 20)
+        self.assertEqual([User.get_task_counters(user_id).tasks_total for user_id in user_ids], [10, 10])
+        self.assertEqual(Task.query.count(), 20)
+
+    def test_update_results(self):
+        """
+        Tests if each update gets its own result, None for a task of another user
+        """
+        user_ids = self._create_users(2)
+        id1 = self.writer.create(user_ids[0], 'Task1', 'Description 1')
+        id2 = self.writer.create(user_ids[1], 'Task2', 'Description 2')
+        results = {}
+        threads = [
+            threading.Thread(target=lambda: results.update(a=self.writer.update(id1, user_ids[0], is_completed=True))),
+            threading.Thread(target=lambda: results.update(b=self.writer.update(id2, user_ids[0], heading='Stolen'))),
+            threading.Thread(target=lambda: results.update(c=self.writer.update(id2, user_ids[1], heading='Mine')))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((results['a'].id, results['a'].is_completed, results['a'].version), (id1, True, 2))
+        self.assertEqual(results['b'], None)
+        self.assertEqual(results['c'].heading, 'Mine')
+        self.assertEqual(User.get_task_counters(user_ids[0]).tasks_completed, 1)
+
+    def test_endpoints(self):
+        """
+        Tests if the create and update endpoints respond as usual with coalescing enabled
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        self.assertNotEqual(id1, id2)
+        response = self.client.post('/tasks/%d/update' % id1, headers=headers, data={'is_completed': 'true'})
+        self.assertEqual(json.loads(response.data.decode())['is_completed'], 'True')
+        response = self.client.post('/tasks/%d/update' % (id2 + 1), headers=headers, data={'heading': 'None'})
+        self.assertEqual(response.status_code, 404)
+        data = json.loads(self.client.get('/tasks/%d' % id1, headers=headers).data.decode())
+        self.assertEqual((data['is_completed'], data['version']), ('True', 2))
@@ -0,0 +1,31 @@
+import unittest
+from project import db
+from project.engine import get_engine_options
+from project.tests.base import BaseTestCase
+
+
+class TestEngine(BaseTestCase):
+    """Tests for the database engine settings"""
+
+    def test_sqlite_pragmas(self):
+        """
+        Tests if the configured pragmas are applied to SQLite connections
+        """
+        pragmas = self.app.config['SQLITE_PRAGMAS']
+        self.assertEqual(db.session.execute('PRAGMA journal_mode').scalar().upper(), pragmas['journal_mode'])
+        self.assertEqual(db.session.execute('PRAGMA busy_timeout').scalar(), pragmas['busy_timeout'])
+
+    def test_server_pool_options(self):
+        """
+        Tests if server databases get the pool settings and SQLite files a thread shareable pool
+        """
+        options = get_engine_options('postgresql://db/tasks', self.app.config)
+        self.assertEqual(options['pool_size'], self.app.config['DATABASE_POOL_SIZE'])
+        self.assertTrue(options['pool_pre_ping'])
+        options = get_engine_options('sqlite:///tasks.db', self.app.config)
+        self.assertEqual(options['connect_args'], {'check_same_thread': False})
+        self.assertEqual(get_engine_options('sqlite://', self.app.config), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import json
+import subprocess
+import sys
+import time
+import unittest
+from project.events import TaskEventHub
+from project.schema import User, Task
+from project.tests.base import BaseTestCase
+from project.tests.task_resources_test import TaskTestUtil
+
+
+def parse_event(frame):
+    """
+    :return: (id, event, data) of a Server-Sent Event frame, None for a keepalive comment
+    """
+    frame = frame.decode()
+    if frame.startswith(':'):
+        return None
+    fields = dict(line.split(': ', 1) for line in frame.strip().split('\n'))
+    return fields.get('id'), fields['event'], json.loads(fields['data'])
+
+
+def read_events(chunks, count, timeout=5):
+    """
+    Reads count events, skipping keepalive comments, from a stream's chunks. The stream's
+    keepalives wake the reader up, so it gives up after timeout seconds without the events.
+    :return: list of (id, event, data)
+    """
+    deadline = time.monotonic() + timeout
+    events = []
+    while len(events) < count:
+        if time.monotonic() > deadline:
+            raise AssertionError("Expected %d events within %ss, got %r" % (count, timeout, events))
+        event = parse_event(next(chunks))
+        if event is not None:
+            events.append(event)
+    return events
+
+
+class TestTaskEvents(BaseTestCase):
+    """Tests for the task change event stream"""
+
+    def setUp(self):
+        super().setUp()
+        self.hub = TaskEventHub(self.app, poll_interval=0.05, queue_size=10)
+        self.previous_hub = self.app.extensions['task_events']
+        self.app.extensions['task_events'] = self.hub
+        self.app.config['TASK_EVENTS_HEARTBEAT'] = 0.1
+
+    def tearDown(self):
+        self.app.extensions['task_events'] = self.previous_hub
+        self.app.config['TASK_EVENTS_HEARTBEAT'] = 15
+        super().tearDown()
+
+    def _open_stream(self, access_token, last_event_id=None):
+        headers = {'Authorization': 'Bearer ' + access_token}
+        if last_event_id is not None:
+            headers['Last-Event-ID'] = str(last_event_id)
+        response = self.client.get('/tasks/events', headers=headers, buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        return response
+
+    def test_stream_writes(self):
+        """
+        Tests if creates, updates and deletes of the user's tasks are pushed to the stream
+        """
+        access_token = TaskTestUtil.get_access_token(self.client)
+        headers = {'Authorization': 'Bearer ' + access_token}
+        response = self._open_stream(access_token)
+        chunks = response.iter_encoded()
+        try:
+            # each write is read before the next one, since writes between two polls are coalesced
+            task_id = self.client.post('/tasks/create', headers=headers,
+                                       data=TaskTestUtil.task_valid_data_1).get_json()['id']
+            events = read_events(chunks, 1)
+            self.client.post('/tasks/%d/update' % task_id, headers=headers, data={'is_completed': 'true'})
+            events += read_events(chunks, 1)
+            self.client.post('/tasks/%d/delete' % task_id, headers=headers)
+            events += read_events(chunks, 1)
+        finally:
+            response.close()
+        self.assertEqual([event for _, event, _ in events], ['create', 'update', 'delete'])
+        self.assertEqual(events[0][2]['heading'], 'Task1')
+        self.assertEqual(events[1][2]['is_completed'], 'True')
+        self.assertEqual(events[2][2], {'id': task_id})
+        self.assertEqual([int(id) for id, _, _ in events], sorted(int(id) for id, _, _ in events))
+        self.assertEqual(self.hub._subscriptions, {})
+
+    def test_coalesced_writes(self):
+        """
+        Tests if the writes to a task between two polls are published as one event with its latest state
+        """
+        access_token = TaskTestUtil.get_access_token(self.client)
+        user_id = User.query.filter_by(username=TaskTestUtil.user_data['username']).first().id
+        cursor = User.get_tasks_version(user_id)
+        id1, id2, _ = TaskTestUtil.create_two_tasks(self.client)
+        headers = {'Authorization': 'Bearer ' + access_token}
+        self.client.post('/tasks/%d/update' % id1, headers=headers, data={'is_completed': 'true'})
+        self.client.post('/tasks/%d/delete' % id2, headers=headers)
+        events = Task.get_change_log(user_id, cursor, User.get_tasks_version(user_id))
+        self.assertEqual([(op, data['id']) for _, op, data in events], [('update', id1), ('delete', id2)])
+
+    def test_unstarted_stream_unsubscribes(self):
+        """
+        Tests if a stream closed before it sent anything drops its subscription
+        """
+        access_token = TaskTestUtil.get_access_token(self.client)
+        response = self._open_stream(access_token)
+        self.assertEqual(len(self.hub._subscriptions), 1)
+        response.close()
+        self.assertEqual(self.hub._subscriptions, {})
+
+    def test_last_event_id_backfill(self):
+        """
+        Tests if a stream opened with Last-Event-ID first sends the writes made after it
+        """
+        task1_id, task2_id, access_token = TaskTestUtil.create_two_tasks(self.client)
+        response = self._open_stream(access_token, last_event_id=0)
+        try:
+            events = read_events(response.iter_encoded(), 2)
+        finally:
+            response.close()
+        self.assertEqual([(event, data['id']) for _, event, data in events],
+                         [('create', task1_id), ('create', task2_id)])
+
+    def test_overflow_resets_stream(self):
+        """
+        Tests if a stream that falls too far behind is sent a reset event and closed
+        """
+        access_token = TaskTestUtil.get_access_token(self.client)
+        response = self._open_stream(access_token)
+        subscription = next(iter(next(iter(self.hub._subscriptions.values()))))
+        subscription.push([(i, 'create', {'id': i}) for i in range(11)])
+        try:
+            self.assertEqual(read_events(response.iter_encoded(), 1), [(None, 'reset', {})])
+        finally:
+            response.close()
+
+    def test_write_from_other_process(self):
+        """
+        Tests if a task written by another process reaches the subscribers of this one
+        """
+        TaskTestUtil.get_access_token(self.client)
+        user_id = User.query.filter_by(username=TaskTestUtil.user_data['username']).first().id
+        subscription = self.hub.subscribe(user_id)
+        try:
+            subprocess.run([sys.executable, '-c', (
+                "from project import create_app\n"
+                "from project.schema import Task\n"
+                "app = create_app('project.config.TestingConfig')\n"
+                "with app.app_context():\n"
+                "    Task(user_id=%d, heading='Remote', description='Written elsewhere', is_completed=False).save()\n"
+            ) % user_id], check=True)
+            events = []
+            for _ in range(50):
+                events += subscription.wait(0.1)
+                if events:
+                    break
+        finally:
+            self.hub.unsubscribe(subscription)
+        self.assertEqual([(op, data['heading']) for _, op, data in events], [('create', 'Remote')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import copy
+import os
+import pstats
+import tempfile
+from sqlalchemy.exc import OperationalError
+from project import db
+from project.metrics import Metrics, Histogram
+from project.tests.base import BaseTestCase
+from project.tests.task_resources_test import TaskTestUtil
+
+
+class TestMetrics(BaseTestCase):
+    """Tests for the request metrics and the /metrics endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        self.metrics = self.app.extensions['metrics']
+        self.app.extensions['metrics'] = Metrics()
+
+    def tearDown(self):
+        self.app.extensions['metrics'] = self.metrics
+        super().tearDown()
+
+    def test_histogram_format(self):
+        """
+        Tests if a histogram renders cumulative buckets, sum and count per label values
+        """
+        histogram = Histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1))
+        histogram.observe(0.05, route='/a')
+        histogram.observe(0.5, route='/a')
+        histogram.observe(5, route='/a"b')
+        self.assertEqual(histogram.collect(), [
+            '# HELP latency_seconds Latency.',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{route="/a",le="0.1"} 1',
+            'latency_seconds_bucket{route="/a",le="1"} 2',
+            'latency_seconds_bucket{route="/a",le="+Inf"} 2',
+            'latency_seconds_sum{route="/a"} 0.55',
+            'latency_seconds_count{route="/a"} 2',
+            'latency_seconds_bucket{route="/a\\"b",le="0.1"} 0',
+            'latency_seconds_bucket{route="/a\\"b",le="1"} 0',
+            'latency_seconds_bucket{route="/a\\"b",le="+Inf"} 1',
+            'latency_seconds_sum{route="/a\\"b"} 5.0',
+            'latency_seconds_count{route="/a\\"b"} 1',
+        ])
+
+    def test_metrics_endpoint(self):
+        """
+        Tests if request latency, SQL, hashing, JWT and validation timings are exposed per route
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        self.client.get('/tasks/%d' % id1, headers=dict(Authorization="Bearer " + access_token))
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.data.decode()
+        self.assertIn('http_request_duration_seconds_count{method="POST",route="/tasks/create",status="200"} 2', text)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/tasks/<int:id>",status="200"} 1',
+                      text)
+        self.assertIn('http_request_sql_queries_count{method="POST",route="/user/register"} 1', text)
+        self.assertIn('http_request_sql_queries_bucket{method="POST",route="/user/register",le="0"} 0', text)
+        self.assertIn('password_hash_duration_seconds_count{operation="hash"} 1', text)
+        self.assertIn('password_hash_duration_seconds_count{operation="verify"} 1', text)
+        self.assertIn('jwt_verify_duration_seconds_count{token_type="access"} 3', text)
+        self.assertIn('request_validation_duration_seconds_count{route="/tasks/create"} 2', text)
+
+    def test_failed_query(self):
+        """
+        Tests if a statement that raises leaves no timing state on its connection
+        """
+        with db.engine.connect() as connection:
+            info = copy.deepcopy(connection.info)
+            with self.assertRaises(OperationalError):
+                connection.exec_driver_sql('SELECT * FROM missing_table')
+            self.assertEqual(connection.exec_driver_sql('SELECT 1').scalar(), 1)
+            self.assertEqual(connection.info, info)
+
+    def test_slow_request_profile(self):
+        """
+        Tests if sampled requests slower than the threshold have their cProfile stats dumped
+        """
+        config = dict(self.app.config)
+        with tempfile.TemporaryDirectory() as directory:
+            self.app.config.update(PROFILE_SAMPLE_RATE=1.0, PROFILE_SLOW_REQUEST_SECONDS=0, PROFILE_DIR=directory)
+            try:
+                response = self.client.post('/user/register', data=TaskTestUtil.user_data)
+                self.assertEqual(response.status_code, 200)
+                self.app.config['PROFILE_SLOW_REQUEST_SECONDS'] = 60
+                self.client.post('/user/login', data=TaskTestUtil.user_data)
+            finally:
+                self.app.config.update(config)
+            names = os.listdir(directory)
+            self.assertEqual(len(names), 1)
+            self.assertIn('POST-user_register', names[0])
+            self.assertTrue(pstats.Stats(os.path.join(directory, names[0])).total_calls > 0)
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+import sqlalchemy
+from alembic.migration import MigrationContext
+from alembic.autogenerate import compare_metadata
+from flask_migrate import upgrade
+from project import create_app, db
+from project.search import is_search_index_name
+
+
+class TestMigrations(unittest.TestCase):
+    """Tests for the database migrations"""
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.app = create_app('project.config.TestingConfig')
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.db_path
+        self.migrations_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'migrations')
+
+    def tearDown(self):
+        os.remove(self.db_path)
+
+    def test_upgrade_matches_models(self):
+        """
+        Tests if upgrading an empty database yields exactly the schema declared by the models
+        """
+        with self.app.app_context():
+            upgrade(directory=self.migrations_dir)
+            with db.engine.connect() as connection:
+                context = MigrationContext.configure(connection, opts={
+                    'include_name': lambda name, type_, parent_names: not is_search_index_name(name)
+                })
+                diff = compare_metadata(context, db.metadata)
+                indexes = [index['name'] for index in sqlalchemy.inspect(connection).get_indexes('tasks')]
+        self.assertEqual(diff, [])
+        self.assertTrue('ix_tasks_user_id_is_completed_id' in indexes)
+
+    def test_upgrade_existing_database(self):
+        """
+        Tests if a database created before migrations existed is upgraded in place
+        """
+        with self.app.app_context():
+            db.engine.execute("CREATE TABLE user (id INTEGER PRIMARY KEY, username VARCHAR(80) NOT NULL UNIQUE, "
+                              "email VARCHAR(120) NOT NULL UNIQUE, password VARCHAR(80) NOT NULL)")
+            db.engine.execute("CREATE TABLE tasks (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES user (id), "
+                              "heading VARCHAR(360), description TEXT, is_completed BOOLEAN NOT NULL)")
+            db.engine.execute("CREATE TABLE revoked_tokens (id INTEGER PRIMARY KEY, token VARCHAR(120))")
+            db.engine.execute("INSERT INTO revoked_tokens (token) VALUES ('old-jti')")
+            upgrade(directory=self.migrations_dir)
+            jtis = [row[0] for row in db.engine.execute("SELECT jti FROM revoked_tokens")]
+            indexes = [index['name'] for index in sqlalchemy.inspect(db.engine).get_indexes('tasks')]
+            tables = sqlalchemy.inspect(db.engine).get_table_names()
+        self.assertEqual(jtis, ['old-jti'])
+        self.assertTrue('tasks_fts' in tables)
+        self.assertTrue('ix_tasks_user_id_id' in indexes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,17 @@
+import hashlib
+import io
+import os
 import json
+import sqlite3
+import tempfile
+import time
 import unittest
-from project.tests.base import BaseTestCase
+from sqlalchemy import create_engine, event
+from flask_jwt_extended import create_access_token, decode_token
+from project import db
+from project.schema import User, Task, TaskTombstone
+from project.tests.base import BaseTestCase, LocalRedis
+from project.cache import TTLCache, RedisCache
 
 
 class TaskTestUtil():
@@ -90,6 +101,57 @@ class TestTaskResources(BaseTestCase, TaskTestUtil):
         self.assertTrue('is_completed' in data2 and data2['is_completed'] == "False")
         self.assertTrue('heading' in data2 and 'description' in data2)
 
+    def test_get_after_update(self):
+        """
+        Tests if a cached task is invalidated by updates and deletes, with either cache backend
+        """
+        task_cache = self.app.extensions['task_cache']
+        for backend in (task_cache, RedisCache(LocalRedis(), ttl=60, prefix='task:')):
+            self.app.extensions['task_cache'] = backend
+            try:
+                id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+                headers = dict(Authorization="Bearer " + access_token)
+                self.client.get('/tasks/%d' % id1, headers=headers)
+                self.client.post('/tasks/%d/update' % id1, headers=headers, data=TaskTestUtil.task_update_valid_data)
+                data = json.loads(self.client.get('/tasks/%d' % id1, headers=headers).data.decode())
+                self.assertEqual(data['is_completed'], 'True')
+                self.client.post('/tasks/%d/delete' % id1, headers=headers)
+                self.assertEqual(self.client.get('/tasks/%d' % id1, headers=headers).status_code, 409)
+                self.client.post('/tasks/batch', headers=headers,
+                                 json={'operations': [{'op': 'update', 'id': id2, 'heading': 'Batch'}]})
+                data = json.loads(self.client.get('/tasks/%d' % id2, headers=headers).data.decode())
+                self.assertEqual(data['heading'], 'Batch')
+            finally:
+                self.app.extensions['task_cache'] = task_cache
+
+    def test_stale_fill_after_update(self):
+        """
+        Tests if a row read before an update cannot be cached after the update invalidated it
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        task = Task.get_task_by_id(id1)
+        stale = dict(task.to_dict(), user_id=task.user_id)
+        self.client.post('/tasks/%d/update' % id1, headers=headers, data=TaskTestUtil.task_update_valid_data)
+        Task._fill_cache(id1, stale)
+        data = json.loads(self.client.get('/tasks/%d' % id1, headers=headers).data.decode())
+        self.assertEqual(data['is_completed'], 'True')
+
+    def test_get_other_user(self):
+        """
+        Tests if a task cannot be read by another user, whether it is cached or not
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        other_user = {'username': 'other', 'password': 'other462', 'email': 'other@gmail.com'}
+        self.client.post('/user/register', data=other_user)
+        other_token = self.client.post('/user/login', data=other_user).get_json()['access_token']
+        response1 = self.client.get('/tasks/%d' % id1, headers=dict(Authorization="Bearer " + other_token))
+        self.client.get('/tasks/%d' % id1, headers=dict(Authorization="Bearer " + access_token))
+        self.assertIn('user_id', self.app.extensions['task_cache'].get(id1))
+        response2 = self.client.get('/tasks/%d' % id1, headers=dict(Authorization="Bearer " + other_token))
+        response3 = self.client.get('/tasks/%d?fields=heading' % id1, headers=dict(Authorization="Bearer " + other_token))
+        self.assertEqual([response.status_code for response in (response1, response2, response3)], [409] * 3)
+
     def test_get_invalid_data(self):
         """
         Tests if the GetTask api handles invalid data well.
@@ -106,9 +168,169 @@ class TestTaskResources(BaseTestCase, TaskTestUtil):
         response = self.client.get('/tasks', headers=dict(Authorization="Bearer " + access_token))
         data = json.loads(response.data.decode())
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(data), 2)
-        res_ids = (data[0]['id'], data[1]['id'])
+        self.assertEqual(len(data['tasks']), 2)
+        res_ids = (data['tasks'][0]['id'], data['tasks'][1]['id'])
         self.assertTrue(id1 in res_ids and id2 in res_ids)
+        self.assertEqual(data['next_cursor'], None)
+
+    def test_list_etag(self):
+        """
+        Tests if a list request with a matching If-None-Match gets 304 until the user's tasks change
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        response1 = self.client.get('/tasks', headers=headers)
+        etag = response1.headers['ETag']
+        response2 = self.client.get('/tasks', headers=dict(headers, **{'If-None-Match': etag}))
+        response3 = self.client.get('/tasks?limit=1', headers=dict(headers, **{'If-None-Match': etag}))
+        self.client.post('/tasks/%d/update' % id1, headers=headers, data=TaskTestUtil.task_update_valid_data)
+        response4 = self.client.get('/tasks', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response1.status_code, 200)
+        self.assertEqual(response2.status_code, 304)
+        self.assertEqual(response2.data, b'')
+        self.assertEqual(response3.status_code, 200)
+        self.assertEqual(response4.status_code, 200)
+        self.assertNotEqual(response4.headers['ETag'], etag)
+
+    def test_get_etag(self):
+        """
+        Tests if a task request with a matching If-None-Match gets 304 until the task changes
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        etag = self.client.get('/tasks/%d' % id1, headers=headers).headers['ETag']
+        response1 = self.client.get('/tasks/%d' % id1, headers=dict(headers, **{'If-None-Match': etag}))
+        self.client.post('/tasks/batch', headers=headers,
+                         json={'operations': [{'op': 'update', 'id': id1, 'heading': 'Batch'}]})
+        response2 = self.client.get('/tasks/%d' % id1, headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response1.status_code, 304)
+        self.assertEqual(response2.status_code, 200)
+
+    def _with_replica(self):
+        """
+        Copies the test database to a replica that the app reads from, and returns a function
+        that removes it
+        """
+        fd, replica_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        primary = db.engine.raw_connection()
+        replica = sqlite3.connect(replica_path)
+        primary.connection.backup(replica)
+        replica.close()
+        primary.close()
+        replica_engine = create_engine('sqlite:///' + replica_path)
+        self.app.extensions['replica_engines'] = [replica_engine]
+
+        def remove():
+            self.app.extensions['replica_engines'] = []
+            replica_engine.dispose()
+            os.remove(replica_path)
+        return remove
+
+    def test_list_reads_replica(self):
+        """
+        Tests if GET requests read from a replica, except for a user that just wrote, even
+        with another token, until the write is no longer recent
+        """
+        id1, id2, writer_token = TaskTestUtil.create_two_tasks(self.client)
+        user_id = User.get_user_by_name(TaskTestUtil.user_data['username']).id
+        remove_replica = self._with_replica()
+        try:
+            self.client.post('/tasks/%d/update' % id1, headers=dict(Authorization="Bearer " + writer_token),
+                             data=TaskTestUtil.task_update_valid_data)
+            second_token = self.client.post('/user/login', data=TaskTestUtil.user_data).get_json()['access_token']
+            response1 = self.client.get('/tasks', headers=dict(Authorization="Bearer " + second_token))
+            self.app.extensions['replica_recent_writers'].delete(user_id)
+            response2 = self.client.get('/tasks/%d' % id1, headers=dict(Authorization="Bearer " + writer_token))
+        finally:
+            remove_replica()
+        self.assertEqual(json.loads(response1.data.decode())['tasks'][0]['is_completed'], 'True')
+        self.assertEqual(json.loads(response2.data.decode())['is_completed'], 'False')
+        self.assertEqual(self.app.extensions['task_cache'].get(id1), {'invalidated': True})
+
+    def test_recent_writers_shared(self):
+        """
+        Tests if a write recorded by another worker process in the shared store sends reads to the primary
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        recent_writers = self.app.extensions['replica_recent_writers']
+        self.app.extensions['replica_recent_writers'] = RedisCache(LocalRedis(), ttl=60)
+        remove_replica = self._with_replica()
+        try:
+            Task.update_task(id1, User.get_user_by_name(TaskTestUtil.user_data['username']).id, is_completed=True)
+            response1 = self.client.get('/tasks/%d' % id1, headers=headers)
+            self.app.extensions['replica_recent_writers'].set(
+                User.get_user_by_name(TaskTestUtil.user_data['username']).id, True)
+            response2 = self.client.get('/tasks/%d' % id1, headers=headers)
+        finally:
+            remove_replica()
+            self.app.extensions['replica_recent_writers'] = recent_writers
+        self.assertEqual(response1.get_json()['is_completed'], 'False')
+        self.assertEqual(response2.get_json()['is_completed'], 'True')
+
+    def test_list_fields(self):
+        """
+        Tests if a listing with fields returns and selects only the requested columns
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = self.client.get('/tasks?fields=heading', headers=dict(Authorization="Bearer " + access_token))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['tasks'], [{'heading': 'Task1'}, {'heading': 'Task2'}])
+        self.assertFalse(any('tasks.description' in statement for statement in statements))
+
+    def test_get_fields(self):
+        """
+        Tests if a task can be retrieved with a subset of fields, and unknown fields are rejected
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        response1 = self.client.get('/tasks/%d?fields=id,is_completed' % id1,
+                                    headers=dict(Authorization="Bearer " + access_token))
+        response2 = self.client.get('/tasks/%d?fields=owner' % id1, headers=dict(Authorization="Bearer " + access_token))
+        self.assertEqual(json.loads(response1.data.decode()), {'id': id1, 'is_completed': 'False'})
+        self.assertEqual(response2.status_code, 400)
+
+    def test_list_pagination(self):
+        """
+        Tests if the tasks can be paged through using limit and next_cursor
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        response1 = self.client.get('/tasks?limit=1', headers=dict(Authorization="Bearer " + access_token))
+        data1 = json.loads(response1.data.decode())
+        response2 = self.client.get('/tasks?limit=1&cursor=%d' % data1['next_cursor'],
+                                    headers=dict(Authorization="Bearer " + access_token))
+        data2 = json.loads(response2.data.decode())
+        self.assertEqual(response1.status_code, 200)
+        self.assertEqual([task['id'] for task in data1['tasks']], [id1])
+        self.assertEqual(data1['next_cursor'], id1)
+        self.assertEqual(response2.status_code, 200)
+        self.assertEqual([task['id'] for task in data2['tasks']], [id2])
+        self.assertEqual(data2['next_cursor'], None)
+
+    def test_list_filters(self):
+        """
+        Tests if the tasks can be filtered on is_completed and id range
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        self.client.post('/tasks/%d/update' % id2, headers=dict(Authorization="Bearer " + access_token),
+                         data=TaskTestUtil.task_update_valid_data)
+        response1 = self.client.get('/tasks?is_completed=true', headers=dict(Authorization="Bearer " + access_token))
+        data1 = json.loads(response1.data.decode())
+        response2 = self.client.get('/tasks?min_id=%d&max_id=%d' % (id1, id1),
+                                    headers=dict(Authorization="Bearer " + access_token))
+        data2 = json.loads(response2.data.decode())
+        self.assertEqual([task['id'] for task in data1['tasks']], [id2])
+        self.assertEqual([task['id'] for task in data2['tasks']], [id1])
 
     def test_list_empty(self):
         """
@@ -118,7 +340,26 @@ class TestTaskResources(BaseTestCase, TaskTestUtil):
         response = self.client.get('/tasks', headers=dict(Authorization="Bearer " + access_token))
         data = json.loads(response.data.decode())
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(data), 0)
+        self.assertEqual(len(data['tasks']), 0)
+        self.assertEqual(data['next_cursor'], None)
+
+    def test_token_carries_user_id(self):
+        """
+        Tests if the issued access token carries the user id claim used by the task endpoints
+        """
+        access_token = TaskTestUtil.get_access_token(self.client)
+        self.assertEqual(decode_token(access_token)['user_claims'], {'user_id': 1})
+
+    def test_list_legacy_token(self):
+        """
+        Tests if a token issued without the user id claim still resolves the user
+        """
+        id1, id2, _ = TaskTestUtil.create_two_tasks(self.client)
+        legacy_token = create_access_token(identity=TaskTestUtil.user_data['username'])
+        response = self.client.get('/tasks', headers=dict(Authorization="Bearer " + legacy_token))
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([task['id'] for task in data['tasks']], [id1, id2])
 
     def test_update(self):
         """
@@ -132,6 +373,114 @@ class TestTaskResources(BaseTestCase, TaskTestUtil):
         self.assertTrue('id' in data and data['id'] == id1)
         self.assertTrue('is_completed' in data and data['is_completed'] == 'True')
 
+    def test_update_is_completed_conversion(self):
+        """
+        Tests if is_completed is converted as a boolean, from form strings and JSON alike
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        response1 = self.client.post('/tasks/%d/update' % id1, headers=headers, data={'is_completed': 'False'})
+        response2 = self.client.post('/tasks/%d/update' % id2, headers=headers, content_type='application/json',
+                                     data=json.dumps({'is_completed': True}))
+        response3 = self.client.post('/tasks/%d/update' % id1, headers=headers, data={'is_completed': 'maybe'})
+        self.assertEqual(json.loads(response1.data.decode())['is_completed'], 'False')
+        self.assertEqual(json.loads(response2.data.decode())['is_completed'], 'True')
+        self.assertEqual(response3.status_code, 400)
+        self.assertTrue('is_completed' in json.loads(response3.data.decode())['message'])
+        response = self.client.get('/tasks/%d' % id1, headers=headers)
+        self.assertEqual(json.loads(response.data.decode())['is_completed'], 'False')
+
+    def test_idempotency_key(self):
+        """
+        Tests if retries with the same Idempotency-Key replay the first response without writing again
+        """
+        access_token = TaskTestUtil.get_access_token(self.client)
+        headers = {'Authorization': "Bearer " + access_token, 'Idempotency-Key': 'create-1'}
+        response1 = self.client.post('/tasks/create', headers=headers, data=TaskTestUtil.task_valid_data_1)
+        response2 = self.client.post('/tasks/create', headers=headers, data=TaskTestUtil.task_valid_data_1)
+        response3 = self.client.post('/tasks/create', headers=headers, data=TaskTestUtil.task_valid_data_2)
+        response4 = self.client.post('/tasks/create', headers=dict(headers, **{'Idempotency-Key': 'create-2'}),
+                                     data=TaskTestUtil.task_valid_data_1)
+        self.assertEqual(response2.status_code, 200)
+        self.assertEqual(json.loads(response2.data.decode()), json.loads(response1.data.decode()))
+        self.assertEqual(response2.headers.get('Idempotent-Replayed'), 'true')
+        self.assertEqual(response1.headers.get('Idempotent-Replayed'), None)
+        self.assertEqual(response3.status_code, 422)
+        self.assertNotEqual(json.loads(response4.data.decode())['id'], json.loads(response1.data.decode())['id'])
+        summary = json.loads(self.client.get('/tasks/summary', headers=headers).data.decode())
+        self.assertEqual(summary['total'], 2)
+
+        id1 = json.loads(response1.data.decode())['id']
+        headers['Idempotency-Key'] = 'update-1'
+        self.client.post('/tasks/%d/update' % id1, headers=headers, data={'heading': 'Updated'})
+        self.client.post('/tasks/%d/update' % id1, headers=headers, data={'heading': 'Updated'})
+        self.assertEqual(json.loads(self.client.get('/tasks/%d' % id1, headers=headers).data.decode())['version'], 2)
+        # keys are scoped to the path, and failed requests are not stored
+        response = self.client.post('/tasks/%d/update' % (id1 + 100), headers=headers, data={'heading': 'Updated'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post('/tasks/%d/update' % (id1 + 100), headers=headers, data={'heading': 'Updated'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_idempotency_claim_expires(self):
+        """
+        Tests if a key is claimed for the claim TTL while its request runs, so one left by a request
+        that never finished is freed after it, and a finished request's response is kept for the key TTL
+        """
+        class RecordingStore(TTLCache):
+            ttls = []
+
+            def add(self, key, value, ttl=None):
+                self.ttls.append(('add', ttl))
+                return super().add(key, value, ttl)
+
+            def set(self, key, value, ttl=None):
+                self.ttls.append(('set', ttl))
+                super().set(key, value, ttl)
+
+        access_token = TaskTestUtil.get_access_token(self.client)
+        headers = {'Authorization': "Bearer " + access_token, 'Idempotency-Key': 'create-1'}
+        body = 'heading=Task1&description=Task1+Description'
+        store_key = '%d:/tasks/create:create-1' % User.get_user_by_name(TaskTestUtil.user_data['username']).id
+        store = self.app.extensions['idempotency_store']
+        self.app.extensions['idempotency_store'] = RecordingStore(10, ttl=self.app.config['IDEMPOTENCY_KEY_TTL'])
+        try:
+            # left by a request whose worker was killed
+            self.app.extensions['idempotency_store'].add(
+                store_key, {'fingerprint': hashlib.sha256(body.encode()).hexdigest()}, ttl=0.05)
+            self.app.extensions['idempotency_store'].ttls = []
+            response1 = self.client.post('/tasks/create', headers=headers, data=body,
+                                         content_type='application/x-www-form-urlencoded')
+            time.sleep(0.1)
+            response2 = self.client.post('/tasks/create', headers=headers, data=body,
+                                         content_type='application/x-www-form-urlencoded')
+            ttls = self.app.extensions['idempotency_store'].ttls
+        finally:
+            self.app.extensions['idempotency_store'] = store
+        self.assertEqual((response1.status_code, response2.status_code), (409, 200))
+        self.assertEqual(ttls, [('add', self.app.config['IDEMPOTENCY_CLAIM_TTL'])] * 2 +
+                         [('set', self.app.config['IDEMPOTENCY_KEY_TTL'])])
+
+    def test_idempotency_reclaim_race(self):
+        """
+        Tests if a retry that finds the key expired, but loses the race to claim it again, gets 409
+        """
+        class RacingStore(TTLCache):
+            # the key is claimed by another retry every time this one looks at it
+            def add(self, key, value, ttl=None):
+                return False
+
+        access_token = TaskTestUtil.get_access_token(self.client)
+        headers = {'Authorization': "Bearer " + access_token, 'Idempotency-Key': 'create-1'}
+        store = self.app.extensions['idempotency_store']
+        self.app.extensions['idempotency_store'] = RacingStore(10)
+        try:
+            response = self.client.post('/tasks/create', headers=headers, data=TaskTestUtil.task_valid_data_1)
+        finally:
+            self.app.extensions['idempotency_store'] = store
+        self.assertEqual(response.status_code, 409)
+        summary = json.loads(self.client.get('/tasks/summary', headers=headers).data.decode())
+        self.assertEqual(summary['total'], 0)
+
     def test_delete_valid_data(self):
         """
         Tests if a valid task can be successfully deleted
@@ -149,4 +498,239 @@ class TestTaskResources(BaseTestCase, TaskTestUtil):
         id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
         response = self.client.post('/tasks/%d/delete' % (id2+1), headers=dict(Authorization="Bearer " + access_token))
         data = json.loads(response.data.decode())
-        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.status_code, 404)
+
+    def test_update_delete_other_user(self):
+        """
+        Tests if a user can neither update nor delete another user's task, and the owner's counters hold
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        other_user = {'username': 'other', 'password': 'other462', 'email': 'other@gmail.com'}
+        self.client.post('/user/register', data=other_user)
+        other_token = json.loads(self.client.post('/user/login', data=other_user).data.decode())['access_token']
+        other_headers = dict(Authorization="Bearer " + other_token)
+        headers = dict(Authorization="Bearer " + access_token)
+        response1 = self.client.post('/tasks/%d/update' % id1, headers=other_headers,
+                                     data=TaskTestUtil.task_update_valid_data)
+        response2 = self.client.post('/tasks/%d/delete' % id1, headers=other_headers)
+        self.assertEqual((response1.status_code, response2.status_code), (404, 404))
+        self.assertEqual(json.loads(self.client.get('/tasks/%d' % id1, headers=headers).data.decode())['is_completed'],
+                         'False')
+        self.client.post('/tasks/%d/update' % id1, headers=headers, data=TaskTestUtil.task_update_valid_data)
+        self.client.post('/tasks/%d/update' % id1, headers=headers, data=TaskTestUtil.task_update_valid_data)
+        self.client.post('/tasks/%d/delete' % id2, headers=headers)
+        summary = json.loads(self.client.get('/tasks/summary', headers=headers).data.decode())
+        self.assertEqual(summary, {'total': 1, 'completed': 1, 'pending': 0})
+        self.client.post('/tasks/%d/delete' % id1, headers=headers)
+        summary = json.loads(self.client.get('/tasks/summary', headers=headers).data.decode())
+        self.assertEqual(summary, {'total': 0, 'completed': 0, 'pending': 0})
+
+    def test_batch(self):
+        """
+        Tests if mixed create/update/delete operations are applied with per-item results
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        operations = [
+            {'op': 'create', 'heading': 'Task3', 'description': 'Task3 Description'},
+            {'op': 'update', 'id': id1, 'is_completed': True},
+            {'op': 'delete', 'id': id2},
+            {'op': 'update', 'id': id2, 'heading': 'Deleted'},
+            {'op': 'create', 'heading': 'Task4'},
+        ]
+        response = self.client.post('/tasks/batch', headers=dict(Authorization="Bearer " + access_token),
+                                    json={'operations': operations})
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in data['results']], [200, 200, 200, 404, 400])
+        id3 = data['results'][0]['id']
+        response = self.client.get('/tasks', headers=dict(Authorization="Bearer " + access_token))
+        tasks = json.loads(response.data.decode())['tasks']
+        self.assertEqual([(task['id'], task['is_completed']) for task in tasks], [(id1, 'True'), (id3, 'False')])
+
+    def test_batch_invalid(self):
+        """
+        Tests if the BatchTasks api rejects a body without a list of operations
+        """
+        access_token = TaskTestUtil.get_access_token(self.client)
+        response = self.client.post('/tasks/batch', headers=dict(Authorization="Bearer " + access_token),
+                                    json={'operations': {'op': 'create'}})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/tasks/batch', headers=dict(Authorization="Bearer " + access_token),
+                                    json=[1, 2])
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_without_writes(self):
+        """
+        Tests if a batch with no valid operation leaves the tasks version, and so the ETags, alone
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        version = User.get_tasks_version(User.get_user_by_name(TaskTestUtil.user_data['username']).id)
+        response = self.client.post('/tasks/batch', headers=headers,
+                                    json={'operations': [{'op': 'update', 'id': id2 + 1}, {'op': 'bogus'}]})
+        self.assertEqual([result['status'] for result in response.get_json()['results']], [404, 400])
+        self.assertEqual(User.get_tasks_version(User.get_user_by_name(TaskTestUtil.user_data['username']).id),
+                         version)
+
+    def test_changes(self):
+        """
+        Tests if only the tasks written and deleted after the cursor are returned
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        response1 = self.client.get('/tasks/changes', headers=headers)
+        data1 = json.loads(response1.data.decode())
+        self.client.post('/tasks/%d/update' % id1, headers=headers, data=TaskTestUtil.task_update_valid_data)
+        self.client.post('/tasks/%d/delete' % id2, headers=headers)
+        response2 = self.client.get('/tasks/changes?since=%d' % data1['cursor'], headers=headers)
+        data2 = json.loads(response2.data.decode())
+        response3 = self.client.get('/tasks/changes?since=%d' % data2['cursor'], headers=headers)
+        data3 = json.loads(response3.data.decode())
+        self.assertEqual(response1.status_code, 200)
+        self.assertEqual([task['id'] for task in data1['tasks']], [id1, id2])
+        self.assertEqual(response2.status_code, 200)
+        self.assertEqual([(task['id'], task['is_completed']) for task in data2['tasks']], [(id1, 'True')])
+        self.assertEqual(data2['deleted'], [id2])
+        self.assertEqual((data3['tasks'], data3['deleted']), ([], []))
+
+    def test_changes_pages(self):
+        """
+        Tests if changes are returned limit at a time, following the cursor while has_more is set
+        """
+        access_token = TaskTestUtil.get_access_token(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        ids = [self.client.post('/tasks/create', headers=headers, data=TaskTestUtil.task_valid_data_1).get_json()['id']
+               for _ in range(3)]
+        self.client.post('/tasks/batch', headers=headers, json={'operations': [
+            {'op': 'create', 'heading': 'Batch%d' % i, 'description': 'Batch'} for i in range(3)]})
+        self.client.post('/tasks/%d/delete' % ids[0], headers=headers)
+        pages = []
+        since = ''
+        while True:
+            data = self.client.get('/tasks/changes?limit=2' + since, headers=headers).get_json()
+            pages.append((len(data['tasks']), len(data['deleted'])))
+            if not data['has_more']:
+                break
+            since = '&since=%d' % data['cursor']
+        # the batch of three is sent whole, and the deletion after it on the next page
+        self.assertEqual(pages, [(2, 0), (3, 0), (0, 1)])
+
+    def test_changes_after_tombstone_purge(self):
+        """
+        Tests if a cursor older than the purged tombstones gets 410, and a newer one still works
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        self.client.post('/tasks/%d/delete' % id1, headers=headers)
+        cursor = self.client.get('/tasks/changes', headers=headers).get_json()['cursor']
+        retention = self.app.config['TASK_TOMBSTONE_RETENTION']
+        self.app.config['TASK_TOMBSTONE_RETENTION'] = -1
+        try:
+            self.assertEqual(TaskTombstone.purge_expired(), 1)
+        finally:
+            self.app.config['TASK_TOMBSTONE_RETENTION'] = retention
+        self.assertEqual(self.client.get('/tasks/changes?since=0', headers=headers).status_code, 410)
+        response = self.client.get('/tasks/changes?since=%d' % cursor, headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_export(self):
+        """
+        Tests if the user's tasks are streamed as newline delimited JSON
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        response = self.client.get('/tasks/export', headers=dict(Authorization="Bearer " + access_token))
+        tasks = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual([task['id'] for task in tasks], [id1, id2])
+
+    def test_import_ndjson(self):
+        """
+        Tests if valid NDJSON rows are imported and invalid ones reported by line
+        """
+        access_token = TaskTestUtil.get_access_token(self.client)
+        body = '\n'.join([
+            json.dumps(TaskTestUtil.task_valid_data_1),
+            json.dumps(TaskTestUtil.task_invalid_data),
+            '{not json',
+            json.dumps(dict(TaskTestUtil.task_valid_data_2, is_completed=True)),
+        ])
+        response = self.client.post('/tasks/import', headers=dict(Authorization="Bearer " + access_token),
+                                    data=body, content_type='application/x-ndjson')
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data['imported'], data['failed']), (2, 2))
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+        response = self.client.get('/tasks', headers=dict(Authorization="Bearer " + access_token))
+        tasks = json.loads(response.data.decode())['tasks']
+        self.assertEqual([(task['heading'], task['is_completed']) for task in tasks],
+                         [('Task1', 'False'), ('Task2', 'True')])
+
+    def test_import_csv(self):
+        """
+        Tests if tasks can be imported from an uploaded CSV file
+        """
+        access_token = TaskTestUtil.get_access_token(self.client)
+        body = 'heading,description,is_completed\nTask1,"Task1, Description",false\nTask2\n'
+        response = self.client.post('/tasks/import?format=csv', headers=dict(Authorization="Bearer " + access_token),
+                                    data={'file': (io.BytesIO(body.encode()), 'tasks.csv')})
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data['imported'], data['failed']), (1, 1))
+        self.assertEqual(data['errors'][0]['line'], 3)
+
+    def test_batch_delete_already_deleted(self):
+        """
+        Tests if a batch delete of a task deleted since ownership was checked leaves the counters
+        and tombstones alone
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        user_id = User.get_user_by_name(TaskTestUtil.user_data['username']).id
+        Task.delete_task(id1, user_id)
+        Task.batch_write(user_id, [], [], [id1, id2])
+        self.assertEqual(tuple(User.get_task_counters(user_id)), (0, 0))
+        self.assertEqual(sorted(row.task_id for row in TaskTombstone.query), [id1, id2])
+
+    def test_summary(self):
+        """
+        Tests if the summary counters follow creates, updates, deletes, batches and imports
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        self.client.post('/tasks/%d/update' % id1, headers=headers, data=TaskTestUtil.task_update_valid_data)
+        self.client.post('/tasks/batch', headers=headers, json={'operations': [
+            {'op': 'create', 'heading': 'Task3', 'description': 'Task3 Description'},
+            {'op': 'update', 'id': id2, 'is_completed': True},
+            {'op': 'delete', 'id': id1},
+        ]})
+        self.client.post('/tasks/import', headers=headers, content_type='application/x-ndjson',
+                         data=json.dumps(dict(TaskTestUtil.task_valid_data_1, is_completed=True)))
+        response = self.client.get('/tasks/summary', headers=headers)
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data, {'total': 3, 'completed': 2, 'pending': 1})
+        User.query.update({'tasks_total': 0, 'tasks_completed': 0})
+        User.rebuild_task_counters()
+        self.assertEqual(json.loads(self.client.get('/tasks/summary', headers=headers).data.decode()), data)
+
+    def test_search(self):
+        """
+        Tests if search returns only the caller's matching tasks, best match first, and follows updates
+        """
+        id1, id2, access_token = TaskTestUtil.create_two_tasks(self.client)
+        headers = dict(Authorization="Bearer " + access_token)
+        self.client.post('/tasks/%d/update' % id2, headers=headers,
+                         data={'heading': 'Groceries', 'description': 'Buy milk and bread'})
+        self.client.post('/tasks/batch', headers=headers, json={'operations': [
+            {'op': 'create', 'heading': 'Milk', 'description': 'Milk delivery "daily"'},
+        ]})
+        response1 = self.client.get('/tasks/search?q=milk', headers=headers)
+        data1 = json.loads(response1.data.decode())
+        response2 = self.client.get('/tasks/search?q=Task2', headers=headers)
+        response3 = self.client.get('/tasks/search?q=milk&limit=1', headers=headers)
+        response4 = self.client.get('/tasks/search?q=%20', headers=headers)
+        self.assertEqual(response1.status_code, 200)
+        self.assertEqual([task['heading'] for task in data1['tasks']], ['Milk', 'Groceries'])
+        self.assertEqual(json.loads(response2.data.decode())['tasks'], [])
+        self.assertEqual(json.loads(response3.data.decode())['next_offset'], 1)
+        self.assertEqual(response4.status_code, 400)
@@ -1,6 +1,9 @@
 import json
+import time
 import unittest
 from project.tests.base import BaseTestCase
+from project.schema import User, RevokedTokens
+from project.hashing import PasswordHasher, HashingPoolFull
 
 
 class UserTestUtil():
@@ -85,6 +88,33 @@ class TestUserResources(BaseTestCase, UserTestUtil):
         response = self.client.post('/user/login', data=UserTestUtil.user_login_invalid_data)
         self.assertEqual(response.status_code, 401)
 
+    def test_login_rehashes_password(self):
+        """
+        Tests if logging in upgrades a password hash made with outdated cost settings
+        """
+        UserTestUtil.register_user(self.client)
+        hasher = self.app.extensions['password_hasher']
+        old_hash = PasswordHasher(rounds=hasher.rounds - 1, workers=0, max_pending=0).hash(
+            UserTestUtil.user_login_valid_data['password'])
+        User.update_password(id=1, password=old_hash)
+        response = self.client.post('/user/login', data=UserTestUtil.user_login_valid_data)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(hasher.needs_update(User.get_user(1).password))
+
+    def test_hashing_pool_full(self):
+        """
+        Tests if hashing is rejected once the pool has no free slots, and the login returns 503
+        """
+        hasher = self.app.extensions['password_hasher']
+        self.assertRaises(HashingPoolFull, PasswordHasher(rounds=1000, workers=1, max_pending=0).hash, 'secret')
+        UserTestUtil.register_user(self.client)
+        self.app.extensions['password_hasher'] = PasswordHasher(rounds=1000, workers=1, max_pending=0)
+        try:
+            response = self.client.post('/user/login', data=UserTestUtil.user_login_valid_data)
+        finally:
+            self.app.extensions['password_hasher'] = hasher
+        self.assertEqual(response.status_code, 503)
+
     def test_update(self):
         """"
         Tests if a user's data can be updated successfully
@@ -108,6 +138,30 @@ class TestUserResources(BaseTestCase, UserTestUtil):
         self.assertEqual(response.status_code, 200)
         self.assertTrue("Success" in data['message'])
 
+    def test_revoked_access_token_rejected(self):
+        """
+        Tests if a revoked access token is rejected even after it was seen as valid
+        """
+        UserTestUtil.register_user(self.client)
+        _, data = UserTestUtil.login_user(self.client)
+        access_token = data["access_token"]
+        response1 = self.client.post('/user/update', headers=dict(Authorization="Bearer " + access_token),
+                                     data=UserTestUtil.user_update_data)
+        self.client.post('/user/access/logout', headers=dict(Authorization="Bearer " + access_token))
+        response2 = self.client.post('/user/update', headers=dict(Authorization="Bearer " + access_token),
+                                     data=UserTestUtil.user_update_data)
+        self.assertEqual(response1.status_code, 200)
+        self.assertEqual(response2.status_code, 401)
+
+    def test_purge_expired_revocations(self):
+        """
+        Tests if expired revocations are purged from the revoked tokens table
+        """
+        RevokedTokens.revoke(jti='expired-jti', exp=int(time.time()) - 60)
+        RevokedTokens.revoke(jti='live-jti', exp=int(time.time()) + 60)
+        RevokedTokens.purge_expired()
+        jtis = [revoked.jti for revoked in RevokedTokens.query.all()]
+        self.assertEqual(jtis, ['live-jti'])
 
     def test_logout_refresh(self):
         """
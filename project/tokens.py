@@ -0,0 +1,54 @@
+from functools import wraps
+from flask_jwt_extended import (create_access_token, create_refresh_token, get_jwt_identity, get_jwt_claims,
+                                verify_jwt_in_request, verify_jwt_refresh_token_in_request)
+from project.metrics import timed
+from project.schema import User
+
+
+def jwt_required(fn):
+    """
+    flask_jwt_extended's jwt_required, recording the time spent verifying the access token
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with timed('jwt_verify_duration', token_type='access'):
+            verify_jwt_in_request()
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def jwt_refresh_token_required(fn):
+    """
+    flask_jwt_extended's jwt_refresh_token_required, recording the time spent verifying the refresh token
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with timed('jwt_verify_duration', token_type='refresh'):
+            verify_jwt_refresh_token_in_request()
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+class Tokens:
+    """"
+    Issues JWTs carrying the user's id as a claim and reads it back in protected endpoints
+    """
+    @staticmethod
+    def create_access_token(username, user_id):
+        return create_access_token(identity=username, user_claims={'user_id': user_id})
+
+    @staticmethod
+    def create_refresh_token(username, user_id):
+        return create_refresh_token(identity=username, user_claims={'user_id': user_id})
+
+    @staticmethod
+    def get_user_id():
+        """
+        Returns the id of the user the current token was issued to. Tokens issued
+        before the id was carried in the claims fall back to a lookup by username.
+        """
+        user_id = get_jwt_claims().get('user_id')
+        if user_id is not None:
+            return user_id
+        user = User.get_user_by_name(username=get_jwt_identity())
+        return user.id if user else None
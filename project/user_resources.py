@@ -1,8 +1,9 @@
 from flask_restful import Resource, abort
 from project.parsers import Parser
 from project.schema import User, RevokedTokens
-from flask_jwt_extended import (create_access_token, create_refresh_token, jwt_required, jwt_refresh_token_required,
-                                get_jwt_identity, get_raw_jwt)
+from project.tokens import Tokens, jwt_required, jwt_refresh_token_required
+from project.hashing import HashingPoolFull
+from flask_jwt_extended import get_jwt_identity, get_raw_jwt
 
 
 class RegisterUser(Resource):
@@ -10,22 +11,26 @@ class RegisterUser(Resource):
     Registers a new User into the system
     """
     def post(self):
-        user_parser = Parser.get_user_parser(password_req=True, email_req=True)
-        user_data = user_parser.parse_args()
+        user_data = Parser.register_user.parse_args()
         if User.get_user_by_name(user_data['username']) or User.get_user_by_email(user_data['email']):
             abort(409, description="User with username - %s  or email %s is already present" % (
                 user_data['username'], user_data['email']))
 
+        try:
+            password = User.generate_hash(user_data['password'])
+        except HashingPoolFull:
+            abort(503, description="Server is busy, please retry")
+
         user = User(
             username=user_data['username'],
-            password=User.generate_hash(user_data['password']),
+            password=password,
             email=user_data['email']
         )
 
         try:
             user.save()
-            access_token = create_access_token(identity=user_data['username'])
-            refresh_token = create_refresh_token(identity=user_data['username'])
+            access_token = Tokens.create_access_token(user_data['username'], user.id)
+            refresh_token = Tokens.create_refresh_token(user_data['username'], user.id)
             return {
                 'message': 'User {} was created'.format(user_data['username']),
                 'access_token': access_token,
@@ -51,13 +56,11 @@ class UpdateUser(Resource):
                 return False
             return True
 
-        user_parser = Parser.get_user_parser(username_req=False)
-        user_data = user_parser.parse_args()
+        user_data = Parser.update_user.parse_args()
         username = get_jwt_identity()
-        user = User.get_user_by_name(username=username)
-        email = user.email if (not has_valid_email(user_data)) else user_data['email']
         try:
-            User.update_user(username=username, email=email)
+            if has_valid_email(user_data):
+                User.update_user(id=Tokens.get_user_id(), email=user_data['email'])
             return {'message': 'User %s data successfully updated' % username}
         except:
             abort(500, description="Failed to update user %s data" % username)
@@ -68,16 +71,27 @@ class LoginUser(Resource):
     Handles a user login request
     """
     def post(self):
-        user_parser = Parser.get_user_parser(username_req=True, password_req=True)
-        user_data = user_parser.parse_args()
+        user_data = Parser.login_user.parse_args()
         user = User.get_user_by_name(user_data['username'])
 
         if not user:
             abort(400, description="Username %s doesn't exist" % user_data['username'])
 
-        if User.verify_hash(user_data['password'], user.password):
-            access_token = create_access_token(identity=user_data['username'])
-            refresh_token = create_refresh_token(identity=user_data['username'])
+        try:
+            password_matches = User.verify_hash(user_data['password'], user.password)
+        except HashingPoolFull:
+            abort(503, description="Server is busy, please retry")
+
+        if password_matches:
+            if User.hash_needs_update(user.password):
+                # Upgrade the stored hash to the configured cost settings; on a busy pool
+                # this is simply retried on a later login.
+                try:
+                    User.update_password(id=user.id, password=User.generate_hash(user_data['password']))
+                except HashingPoolFull:
+                    pass
+            access_token = Tokens.create_access_token(user_data['username'], user.id)
+            refresh_token = Tokens.create_refresh_token(user_data['username'], user.id)
             return {
                 'message': 'User {} is logged in.'.format(user_data['username']),
                 'access_token': access_token,
@@ -94,10 +108,9 @@ class LogoutUserAccess(Resource):
     """
     @jwt_required
     def post(self):
-        token = get_raw_jwt()['jti']
+        raw_token = get_raw_jwt()
         try:
-            revoked_token = RevokedTokens(token=token)
-            revoked_token.save()
+            RevokedTokens.revoke(jti=raw_token['jti'], exp=raw_token.get('exp'))
             return {'message': 'Successfully revoked access token'}
         except:
             abort(500, description='failed to revoke access token')
@@ -110,10 +123,9 @@ class LogoutUserRefresh(Resource):
     """
     @jwt_refresh_token_required
     def post(self):
-        token = get_raw_jwt()['jti']
+        raw_token = get_raw_jwt()
         try:
-            revoked_token = RevokedTokens(token=token)
-            revoked_token.save()
+            RevokedTokens.revoke(jti=raw_token['jti'], exp=raw_token.get('exp'))
             return {'message': 'Successfully revoked refresh token'}
         except:
             abort(500, description='failed to revoke refresh token')
@@ -127,5 +139,5 @@ class RefreshToken(Resource):
     @jwt_refresh_token_required
     def post(self):
         current_user = get_jwt_identity()
-        access_token = create_access_token(identity=current_user)
+        access_token = Tokens.create_access_token(current_user, Tokens.get_user_id())
         return {"access_token": access_token}
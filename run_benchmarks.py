@@ -0,0 +1,106 @@
+from project import create_app, db
+from flask.cli import FlaskGroup
+from flask_jwt_extended import JWTManager
+from flask_migrate import upgrade
+from project.manage_resources import ResourcesManager
+from project.benchmark import Benchmark, HttpClient, compare, load_baseline, save_baseline as store_baseline
+import click
+import json
+import os
+
+app = create_app('project.config.BenchmarkConfig')
+jwt = JWTManager(app)
+cli = FlaskGroup(create_app=lambda *args: app)
+ResourcesManager.add_resources(app)
+
+from project import schema
+
+@jwt.token_in_blacklist_loader
+def token_blacklisting_check(raw_token):
+    """"
+    Called before every request if the endpoint is jwt (whether refresh or access) protected
+    """
+    token = raw_token['jti']
+    return schema.RevokedTokens.is_token_revoked(token)
+
+def reset_database():
+    """
+    Recreates the benchmark database through the migrations, like a served database, so a
+    server started on it finds nothing left to upgrade
+    """
+    with app.app_context():
+        db.drop_all()
+        db.session.execute('DROP TABLE IF EXISTS alembic_version')
+        db.session.commit()
+        upgrade(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
+
+@cli.command()
+@click.option('--users', type=click.IntRange(min=1), default=10, help='Users to seed')
+@click.option('--tasks', type=click.IntRange(min=1), default=1000, help='Tasks to seed per user')
+@click.option('--requests', type=click.IntRange(min=1), default=200, help='Requests per operation')
+@click.option('--baseline', type=click.Path(dir_okay=False), default='benchmark_baseline.json',
+              help='Baseline results to compare against')
+@click.option('--tolerance', type=float, default=0.2,
+              help='Allowed p95 latency increase or throughput drop, as a fraction of the baseline')
+@click.option('--save-baseline', is_flag=True, help='Store the results as the new baseline')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='Also write the results as JSON')
+@click.option('--url', default=None,
+              help='Benchmark a running server, started on DATABASE_BENCHMARK_URL, instead of the app in process')
+def benchmark(users, tasks, requests, baseline, tolerance, save_baseline, output, url):
+    """ Seeds the benchmark database and measures the endpoints"""
+    reset_database()
+    bench = Benchmark(app, users=users, tasks_per_user=tasks, requests=requests,
+                      client=HttpClient(url) if url else None)
+    bench.seed()
+    results = bench.run()
+
+    click.echo('%-8s %8s %7s %12s %10s %10s %10s %14s' % (
+        'op', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'validation us'))
+    for operation, result in results.items():
+        click.echo('%-8s %8d %7d %12.2f %10.3f %10.3f %10.3f %14s' % (
+            operation, result['requests'], result['errors'], result['throughput'],
+            result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            '%.3f' % result['validation_us'] if 'validation_us' in result else '-'))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if save_baseline:
+        store_baseline(baseline, results)
+        click.echo('Baseline saved to %s' % baseline)
+        return 0
+
+    baseline_results = load_baseline(baseline)
+    if baseline_results is None:
+        click.echo('No baseline at %s, run with --save-baseline to record one' % baseline)
+        return 0
+    regressions = compare(results, baseline_results, tolerance)
+    for regression in regressions:
+        click.echo('REGRESSION %s' % regression, err=True)
+    if regressions:
+        raise SystemExit(1)
+    click.echo('No regressions against %s' % baseline)
+    return 0
+
+@cli.command()
+@click.option('--url', required=True, help='Running server, started on DATABASE_BENCHMARK_URL')
+@click.option('--users', type=click.IntRange(min=1), default=10, help='Users to seed')
+@click.option('--tasks', type=click.IntRange(min=1), default=100, help='Tasks to seed per user')
+@click.option('--clients', type=click.IntRange(min=1), default=50, help='Concurrent clients reading tasks')
+@click.option('--requests', type=click.IntRange(min=1), default=20, help='Reads per client')
+@click.option('--streams', type=click.IntRange(min=0), default=0,
+              help='Event streams held open by idle clients during the reads')
+def concurrency(url, users, tasks, clients, requests, streams):
+    """ Measures task reads from many concurrent clients, with idle event streams open"""
+    reset_database()
+    bench = Benchmark(app, users=users, tasks_per_user=tasks, requests=requests, client=HttpClient(url))
+    bench.seed()
+    result = bench.run_concurrent(clients, streams)
+    click.echo('%8s %8s %8s %7s %12s %10s %10s %10s' % (
+        'clients', 'streams', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    click.echo('%8d %8d %8d %7d %12.2f %10.3f %10.3f %10.3f' % (
+        result['clients'], result['streams'], result['requests'], result['errors'], result['throughput'],
+        result['p50_ms'], result['p95_ms'], result['p99_ms']))
+    return 0
+
+if __name__=="__main__":
+    cli()
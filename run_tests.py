@@ -6,7 +6,7 @@ import unittest
 
 app = create_app('project.config.TestingConfig')
 jwt = JWTManager(app)
-cli = FlaskGroup(app)
+cli = FlaskGroup(create_app=lambda *args: app)
 ResourcesManager.add_resources(app)
 
 from project import schema
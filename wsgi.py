@@ -0,0 +1,4 @@
+"""
+WSGI entry point for production servers, see gunicorn.conf.py
+"""
+from manage import app